@@ -0,0 +1,328 @@
+# lightdm-kbswitch-greeter A Gtk3 based greeter for LightDM
+# Copyright (C) 2016 Andrew Bates
+# Author Andrew Bates <andrew.bates@cantab.net>
+# Based on lightdm-gtk-greeter Copyright (C) 2010-2011 Robert Ancell
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Stand-in for the LightDM GObject introspection module
+
+install() puts a fake LightDM module in place of gi.repository.LightDM so
+that the greeter can be run without a display manager. The fake serves a
+configurable number of languages, keyboard layouts, sessions and users,
+answers authentication with a password prompt and records when the
+greeter calls into it so that the benchmark can time each step.
+"""
+
+import gi
+gi.require_version('GLib', '2.0')
+from gi.repository import GLib, GObject
+import sys
+import time
+import types
+
+# Times, from time.perf_counter(), of calls made by the greeter
+events = {}
+# Number of calls to functions that are expensive on a real system
+counters = {'set_layout': 0, 'get_layout': 0}
+
+
+def _record(name):
+    events.setdefault(name, time.perf_counter())
+
+
+class PromptType:
+    QUESTION = 0
+    SECRET = 1
+
+
+class MessageType:
+    INFO = 0
+    ERROR = 1
+
+
+class Language:
+    def __init__(self, code, name, territory):
+        self._code = code
+        self._name = name
+        self._territory = territory
+
+    def get_code(self):
+        return self._code
+
+    def get_name(self):
+        return self._name
+
+    def get_territory(self):
+        return self._territory
+
+
+class Layout:
+    def __init__(self, name, description):
+        self._name = name
+        self._description = description
+
+    def get_name(self):
+        return self._name
+
+    def get_description(self):
+        return self._description
+
+    def get_short_description(self):
+        return self._name.split()[0]
+
+
+class Session:
+    def __init__(self, key, name):
+        self._key = key
+        self._name = name
+
+    def get_key(self):
+        return self._key
+
+    def get_name(self):
+        return self._name
+
+
+class User(GObject.GObject):
+    def __init__(self, name, logged_in=False, session=None):
+        GObject.GObject.__init__(self)
+        self._name = name
+        self._logged_in = logged_in
+        self._session = session
+
+    def get_name(self):
+        return self._name
+
+    def get_display_name(self):
+        return self._name
+
+    def get_real_name(self):
+        return self._name
+
+    def get_logged_in(self):
+        return self._logged_in
+
+    def get_session(self):
+        return self._session
+
+
+class UserList(GObject.GObject):
+    __gsignals__ = {
+        'user-added': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+        'user-changed': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+        'user-removed': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+    }
+
+    _instance = None
+    _users = []
+
+    @classmethod
+    def get_instance(cls):
+        if not cls._instance:
+            _record('UserList.get_instance')
+            cls._instance = cls()
+        return cls._instance
+
+    def get_users(self):
+        return list(self._users)
+
+    def get_length(self):
+        return len(self._users)
+
+    def get_user_by_name(self, name):
+        for user in self._users:
+            if user.get_name() == name:
+                return user
+        return None
+
+
+class Greeter(GObject.GObject):
+    __gsignals__ = {
+        'authentication-complete': (GObject.SignalFlags.RUN_LAST, None, ()),
+        'show-message': (GObject.SignalFlags.RUN_LAST, None,
+                (str, object)),
+        'show-prompt': (GObject.SignalFlags.RUN_LAST, None, (str, object)),
+    }
+
+    # Simulated latencies in milliseconds
+    connect_latency = 0
+    pam_latency = 0
+    session_latency = 0
+    on_session_started = None
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+        self._user = None
+        self._in_authentication = False
+        self._is_authenticated = False
+
+    def connect_to_daemon(self, cancellable, callback, user_data):
+        _record('connect_to_daemon')
+        GLib.timeout_add(self.connect_latency,
+                self._connected_cb, callback, user_data)
+
+    def _connected_cb(self, callback, user_data):
+        callback(self, None, user_data)
+        return False
+
+    def connect_to_daemon_finish(self, result):
+        return True
+
+    def connect_to_daemon_sync(self):
+        _record('connect_to_daemon')
+        time.sleep(self.connect_latency / 1000)
+        return True
+
+    def get_default_session_hint(self):
+        return 'session0'
+
+    def authenticate(self, username):
+        _record('authenticate')
+        self._user = username
+        self._in_authentication = True
+        self._is_authenticated = False
+        GLib.timeout_add(self.pam_latency, self._prompt_cb)
+
+    def _prompt_cb(self):
+        if self._in_authentication:
+            self.emit('show-prompt', 'Password: ', PromptType.SECRET)
+        return False
+
+    def respond(self, response):
+        _record('respond')
+        GLib.timeout_add(self.pam_latency, self._complete_cb)
+
+    def _complete_cb(self):
+        if self._in_authentication:
+            self._in_authentication = False
+            self._is_authenticated = True
+            self.emit('authentication-complete')
+        return False
+
+    def cancel_authentication(self):
+        _record('cancel_authentication')
+        if self._in_authentication:
+            self._in_authentication = False
+            GLib.idle_add(self._cancelled_cb)
+
+    def _cancelled_cb(self):
+        self.emit('authentication-complete')
+        return False
+
+    def get_in_authentication(self):
+        return self._in_authentication
+
+    def get_is_authenticated(self):
+        return self._is_authenticated
+
+    def get_authentication_user(self):
+        return self._user
+
+    def set_language(self, language):
+        pass
+
+    def start_session_sync(self, session):
+        _record('start_session')
+        time.sleep(self.session_latency / 1000)
+        self._session_started()
+        return True
+
+    def start_session(self, session, cancellable, callback, user_data):
+        _record('start_session')
+        GLib.timeout_add(self.session_latency, self._session_cb,
+                callback, user_data)
+
+    def _session_cb(self, callback, user_data):
+        self._session_started()
+        callback(self, None, user_data)
+        return False
+
+    def start_session_finish(self, result):
+        return True
+
+    def _session_started(self):
+        _record('session_started')
+        if self.on_session_started:
+            GLib.idle_add(self.on_session_started)
+
+
+def _build_module(languages, layouts, sessions, users, logged_in):
+    module = types.ModuleType('LightDM')
+    module.PromptType = PromptType
+    module.MessageType = MessageType
+    module.Greeter = Greeter
+    module.UserList = UserList
+    module.User = User
+    module.Layout = Layout
+    module.Language = Language
+    module.Session = Session
+
+    language_list = [Language('l{0}_T{0}.UTF-8'.format(i),
+            'Language {0}'.format(i), 'Territory {0}'.format(i))
+            for i in range(languages)]
+    # Roughly a fifth of layouts are the plain layout for a region and the
+    # rest variants of it, as in the XKB catalogue
+    layout_list = []
+    for i in range(layouts):
+        region = 'r{0}'.format(i // 5)
+        if i % 5 == 0:
+            layout_list.append(Layout(region,
+                    'Language {0} (Region {0})'.format(i // 5)))
+        else:
+            layout_list.append(Layout('{0}\tv{1}'.format(region, i % 5),
+                    'Region {0} (variant {1})'.format(i // 5, i % 5)))
+    session_list = [Session('session{0}'.format(i), 'Session {0}'.format(i))
+            for i in range(sessions)]
+    UserList._users = [User('user{0}'.format(i), i < logged_in, 'session0')
+            for i in range(users)]
+    state = {'layout': layout_list[0] if layout_list else None}
+
+    def get_layout():
+        counters['get_layout'] += 1
+        return state['layout']
+
+    def set_layout(layout):
+        counters['set_layout'] += 1
+        state['layout'] = layout
+
+    module.get_languages = lambda: language_list
+    module.get_language = lambda: (language_list[0] if language_list
+            else None)
+    module.get_layouts = lambda: layout_list
+    module.get_layout = get_layout
+    module.set_layout = set_layout
+    module.get_sessions = lambda: session_list
+    module.get_hostname = lambda: 'benchmark'
+    for action in ('suspend', 'hibernate', 'restart', 'shutdown'):
+        setattr(module, 'get_can_' + action, lambda: True)
+        setattr(module, action, lambda: True)
+    return module
+
+
+def install(languages=50, layouts=500, sessions=5, users=100,
+        logged_in=0):
+    """Replace gi.repository.LightDM with the fake"""
+    module = _build_module(languages, layouts, sessions, users, logged_in)
+    require_version = gi.require_version
+
+    def fake_require_version(namespace, version):
+        if namespace != 'LightDM':
+            require_version(namespace, version)
+
+    gi.require_version = fake_require_version
+    import gi.repository
+    sys.modules['gi.repository.LightDM'] = module
+    gi.repository.LightDM = module
+    return module
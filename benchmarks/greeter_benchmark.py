@@ -0,0 +1,285 @@
+# lightdm-kbswitch-greeter A Gtk3 based greeter for LightDM
+# Copyright (C) 2016 Andrew Bates
+# Author Andrew Bates <andrew.bates@cantab.net>
+# Based on lightdm-gtk-greeter Copyright (C) 2010-2011 Robert Ancell
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Headless end-to-end benchmark of the greeter
+
+Runs greeter.run() against the fake LightDM module in fake_lightdm.py on an
+Xvfb server, logs in as the first user and reports:
+
+    first_frame        time from start until the interface is first drawn
+    login_to_auth      time from submitting the login until authenticate()
+    auth_to_session    time from authenticate() until the session started
+    session_start      time from start until the session started
+    peak_rss_kb        peak resident memory
+    locked_kb          memory locked with mlock/mlockall
+
+With --sweeps the pointer is first moved across every monitor that many
+times, stopping on each for --sweep-dwell ms, and the number of times the
+interface moved monitor and was allocated during the sweeps is reported as
+sweep_moves and sweep_relayouts.
+
+Usage, from the top of the source tree:
+
+    python3 benchmarks/greeter_benchmark.py --layouts 1000 --repeat 5
+    python3 benchmarks/greeter_benchmark.py --screens 4 --sweeps 10
+
+Xvfb is started on a free display unless --display is given. Each run is
+made in a new process as the greeter keeps its state in module globals.
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.dirname(HERE)
+DATA_DIR = os.path.join(TOP, 'data')
+RESULT_PREFIX = 'RESULT '
+METRICS = ('first_frame', 'login_to_auth', 'auth_to_session',
+        'session_start', 'peak_rss_kb', 'locked_kb')
+
+
+def read_status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def write_config(args, directory):
+    path = os.path.join(directory, 'lightdm-kbswitch-greeter.conf')
+    with open(path, 'w') as f:
+        f.write('[greeter]\n')
+        f.write('keyboard-layout-regions = {0}\n'.format(
+                ';'.join('r{0}'.format(i) for i in range(args.regions))))
+        f.write('background-cache-dir = {0}\n'.format(
+                os.path.join(directory, 'cache')))
+        if args.background:
+            f.write('background = {0}\n'.format(args.background))
+        for option in args.option:
+            f.write(option + '\n')
+    return path
+
+
+def run_once(args):
+    """Run the greeter in this process and print the result"""
+    sys.path.insert(0, TOP)
+    sys.path.insert(0, HERE)
+    import fake_lightdm
+    lightdm = fake_lightdm.install(args.languages, args.layouts,
+            args.sessions, args.users, args.logged_in)
+    lightdm.Greeter.connect_latency = args.connect_latency
+    lightdm.Greeter.pam_latency = args.pam_latency
+    lightdm.Greeter.session_latency = args.session_latency
+
+    from gi.repository import Gdk, GLib, Gtk
+    from lightdm_kbswitch_greeter import greeter
+
+    directory = tempfile.mkdtemp(prefix='greeter-benchmark-')
+    greeter.CONFIG_FILE = write_config(args, directory)
+    greeter.UI_FILE = os.path.join(DATA_DIR, 'lightdm-kbswitch-greeter.ui')
+    greeter.CSS_APPLICATION_FILE = os.path.join(DATA_DIR,
+            'lightdm-kbswitch-greeter-application.css')
+    greeter.RESOURCE_FILE = os.path.join(directory, 'missing.gresource')
+
+    times = {'start': time.perf_counter()}
+    first_draw_cb = greeter.first_draw_cb
+
+    def login_cb():
+        greeter.username_entry.set_text('user0')
+        greeter.password_entry.set_text('password')
+        times['login'] = time.perf_counter()
+        greeter.login_cb(greeter.login_window)
+        return False
+
+    sweep = {'positions': [], 'stats': None}
+
+    def sweep_cb():
+        surface = greeter.greeter_surface
+        if sweep['stats'] is None:
+            sweep['stats'] = dict(surface.stats)
+            monitors = [m for m in surface.monitors if m.is_enabled]
+            for i in range(args.sweeps):
+                # Back and forth as when the pointer is dragged along a row
+                for monitor in (monitors if i % 2 == 0 else monitors[::-1]):
+                    geometry = monitor.geometry
+                    sweep['positions'].append((
+                            geometry.x + geometry.width // 2,
+                            geometry.y + geometry.height // 2))
+        if not sweep['positions']:
+            for key, value in surface.stats.items():
+                sweep[key] = value - sweep['stats'][key]
+            login_cb()
+            return False
+        x, y = sweep['positions'].pop(0)
+        display = Gdk.Display.get_default()
+        display.get_default_seat().get_pointer().warp(
+                display.get_default_screen(), x, y)
+        return True
+
+    def benchmark_first_draw_cb(widget, cr):
+        times['first_frame'] = time.perf_counter()
+        if args.sweeps:
+            GLib.timeout_add(args.sweep_dwell, sweep_cb)
+        else:
+            GLib.idle_add(login_cb)
+        return first_draw_cb(widget, cr)
+
+    def session_started_cb():
+        Gtk.main_quit()
+        return False
+
+    def timeout_cb():
+        print('Timed out waiting for the session to start', file=sys.stderr)
+        Gtk.main_quit()
+        return False
+
+    greeter.first_draw_cb = benchmark_first_draw_cb
+    lightdm.Greeter.on_session_started = session_started_cb
+    GLib.timeout_add_seconds(args.timeout, timeout_cb)
+    greeter.run()
+
+    events = fake_lightdm.events
+    if 'session_started' not in events:
+        sys.exit(1)
+    result = {
+            'first_frame': times['first_frame'] - times['start'],
+            'login_to_auth': events['authenticate'] - times['login'],
+            'auth_to_session': (events['session_started'] -
+                    events['authenticate']),
+            'session_start': events['session_started'] - times['start'],
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'locked_kb': read_status_kb('VmLck'),
+            'set_layout_calls': fake_lightdm.counters['set_layout'],
+            'get_layout_calls': fake_lightdm.counters['get_layout']
+            }
+    if args.sweeps:
+        result['sweep_moves'] = sweep['moves']
+        result['sweep_relayouts'] = sweep['relayouts']
+    print(RESULT_PREFIX + json.dumps(result))
+    sys.stdout.flush()
+
+
+def start_xvfb(args):
+    for display in range(99, 199):
+        if not os.path.exists('/tmp/.X11-unix/X{0}'.format(display)):
+            break
+    command = ['Xvfb', ':{0}'.format(display), '-nolisten', 'tcp']
+    if args.screens > 1:
+        command.append('+xinerama')
+    for i in range(args.screens):
+        command.extend(['-screen', str(i), args.geometry + 'x24'])
+    xvfb = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+    socket = '/tmp/.X11-unix/X{0}'.format(display)
+    for _ in range(100):
+        if os.path.exists(socket): break
+        time.sleep(0.05)
+    return xvfb, ':{0}'.format(display)
+
+
+def run_all(args):
+    xvfb = None
+    env = dict(os.environ)
+    if args.display:
+        env['DISPLAY'] = args.display
+    else:
+        xvfb, env['DISPLAY'] = start_xvfb(args)
+
+    command = [sys.executable, os.path.abspath(__file__), '--once']
+    command.extend(sys.argv[1:])
+    results = []
+    try:
+        for _ in range(args.repeat):
+            output = subprocess.run(command, env=env, check=True,
+                    stdout=subprocess.PIPE, universal_newlines=True).stdout
+            for line in output.splitlines():
+                if line.startswith(RESULT_PREFIX):
+                    results.append(json.loads(line[len(RESULT_PREFIX):]))
+    finally:
+        if xvfb:
+            xvfb.terminate()
+            xvfb.wait()
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    for metric in sorted(results[0].keys()):
+        values = [r[metric] for r in results]
+        if metric in ('first_frame', 'login_to_auth', 'auth_to_session',
+                'session_start'):
+            print('{0:20} median {1:8.1f}ms  min {2:8.1f}ms  max {3:8.1f}ms'
+                    .format(metric, statistics.median(values) * 1000,
+                            min(values) * 1000, max(values) * 1000))
+        else:
+            print('{0:20} median {1:8}    min {2:8}    max {3:8}'.format(
+                    metric, statistics.median(values), min(values),
+                    max(values)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--once', action='store_true',
+            help=argparse.SUPPRESS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true',
+            help='print the results of each run as JSON')
+    parser.add_argument('--display',
+            help='X display to use instead of starting Xvfb')
+    parser.add_argument('--screens', type=int, default=1,
+            help='number of Xvfb screens, joined with Xinerama')
+    parser.add_argument('--geometry', default='1920x1080')
+    parser.add_argument('--languages', type=int, default=50)
+    parser.add_argument('--layouts', type=int, default=500)
+    parser.add_argument('--regions', type=int, default=10,
+            help='number of regions listed in keyboard-layout-regions')
+    parser.add_argument('--sessions', type=int, default=5)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--logged-in', type=int, default=0)
+    parser.add_argument('--connect-latency', type=int, default=0,
+            help='simulated daemon connection time in ms')
+    parser.add_argument('--pam-latency', type=int, default=0,
+            help='simulated time for each PAM step in ms')
+    parser.add_argument('--session-latency', type=int, default=0,
+            help='simulated session start time in ms')
+    parser.add_argument('--sweeps', type=int, default=0,
+            help='times to move the pointer across the monitors before '
+            'logging in')
+    parser.add_argument('--sweep-dwell', type=int, default=50,
+            help='time the pointer stays on each monitor in ms')
+    parser.add_argument('--background',
+            help='background option, e.g. the path to an image')
+    parser.add_argument('--option', action='append', default=[],
+            help='extra line for the [greeter] config section')
+    parser.add_argument('--timeout', type=int, default=60,
+            help='seconds to wait for the session to start')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.once:
+        run_once(arguments)
+    else:
+        run_all(arguments)
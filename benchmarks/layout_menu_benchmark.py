@@ -0,0 +1,114 @@
+# lightdm-kbswitch-greeter A Gtk3 based greeter for LightDM
+# Copyright (C) 2016 Andrew Bates
+# Author Andrew Bates <andrew.bates@cantab.net>
+# Based on lightdm-gtk-greeter Copyright (C) 2010-2011 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Micro-benchmark of building the keyboard layout menu
+
+Builds a LayoutIndex from synthetic catalogues of fake layouts of several
+sizes and times generate_layout_menu_items() with every region listed in
+keyboard-layout-regions, so that every layout is in the menu. For each
+catalogue size it reports:
+
+    index      time to build the LayoutIndex
+    menu       time to generate the menu items
+    per_layout menu time divided by the number of layouts, which stays
+               roughly constant if generation scales linearly
+
+Usage, from the top of the source tree:
+
+    python3 benchmarks/layout_menu_benchmark.py --sizes 250,500,1000,2000
+
+Xvfb is started on a free display, as Gtk needs one to create menu items,
+unless DISPLAY is set.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from configparser import ConfigParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOP = os.path.dirname(HERE)
+
+
+def time_size(greeter, greeter_keyboard, fake_lightdm, size, repeat):
+    """Return the median index and menu generation times for size layouts"""
+    layouts = fake_lightdm._build_module(0, size, 0, 0, 0).get_layouts()
+    config = ConfigParser()
+    config['greeter'] = {'keyboard-layout-regions': ';'.join(
+            sorted(set(greeter_keyboard.get_layout_region(l)
+                    for l in layouts)))}
+    greeter.greeter_config = config['greeter']
+
+    index_times = []
+    menu_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        greeter.layout_index = greeter_keyboard.LayoutIndex(layouts)
+        index_times.append(time.perf_counter() - start)
+        greeter.layout_controller = greeter_keyboard.LayoutController(
+                layouts[0])
+
+        start = time.perf_counter()
+        items = list(greeter.generate_layout_menu_items(
+                layouts[0], layouts[0]))
+        menu_times.append(time.perf_counter() - start)
+        for item in items:
+            item.destroy()
+    return statistics.median(index_times), statistics.median(menu_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='250,500,1000,2000,4000',
+            help='comma separated numbers of layouts in the catalogue')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    xvfb = None
+    if not os.environ.get('DISPLAY'):
+        sys.path.insert(0, HERE)
+        import greeter_benchmark
+        xvfb, os.environ['DISPLAY'] = greeter_benchmark.start_xvfb(
+                argparse.Namespace(screens=1, geometry='1024x768'))
+
+    try:
+        sys.path.insert(0, TOP)
+        sys.path.insert(0, HERE)
+        import fake_lightdm
+        fake_lightdm.install()
+        from lightdm_kbswitch_greeter import greeter
+        from lightdm_kbswitch_greeter import greeter_keyboard
+
+        print('{0:>8} {1:>10} {2:>10} {3:>12}'.format(
+                'layouts', 'index', 'menu', 'per_layout'))
+        for size in (int(i) for i in args.sizes.split(',')):
+            index_time, menu_time = time_size(greeter, greeter_keyboard,
+                    fake_lightdm, size, args.repeat)
+            print('{0:8} {1:8.1f}ms {2:8.1f}ms {3:10.1f}us'.format(size,
+                    index_time * 1000, menu_time * 1000,
+                    menu_time / size * 1000000))
+    finally:
+        if xvfb:
+            xvfb.terminate()
+            xvfb.wait()
+
+
+if __name__ == '__main__':
+    main()
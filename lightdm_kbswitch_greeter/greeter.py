@@ -19,6 +19,10 @@
 import sys
 sys.path.append('/home/andrew/projects/lightdm-kbswitch-greeter')
 from lightdm_kbswitch_greeter import greeter_background
+from lightdm_kbswitch_greeter import greeter_keyboard
+from lightdm_kbswitch_greeter import greeter_trace
+from lightdm_kbswitch_greeter import greeter_users
+from lightdm_kbswitch_greeter.greeter_keyboard import get_layout_region
 
 import locale, gettext
 _ = gettext.gettext
@@ -26,13 +30,19 @@ _ = gettext.gettext
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('LightDM', '1')
-from gi.repository import GLib, Gtk, Gdk, LightDM
+from gi.repository import GLib, Gio, Gtk, Gdk, LightDM
 
 import ctypes
+import signal
+import time
 from time import strftime
 from configparser import ConfigParser
 from typing import Any, Generator
 import logging
+import logging.handlers
+import atexit
+import os
+import queue
 
 APP_NAME             = 'lightdm-kbswitch-greeter'
 LOCALE_DIR           = '/usr/share/locale'
@@ -41,20 +51,59 @@ APP_DATA_DIR         = '/usr/share/' + APP_NAME
 UI_FILE              = APP_DATA_DIR + '/lightdm-kbswitch-greeter.ui'
 CSS_APPLICATION_FILE = (APP_DATA_DIR +
         '/lightdm-kbswitch-greeter-application.css')
+RESOURCE_FILE        = APP_DATA_DIR + '/lightdm-kbswitch-greeter.gresource'
+RESOURCE_PREFIX      = '/' + APP_NAME
+UI_RESOURCE          = RESOURCE_PREFIX + '/lightdm-kbswitch-greeter.ui'
+CSS_APPLICATION_RESOURCE = (RESOURCE_PREFIX +
+        '/lightdm-kbswitch-greeter-application.css')
+ICON_RESOURCE_PATH   = RESOURCE_PREFIX + '/icons'
 CONFIG_GROUP_DEFAULT = 'greeter'
 DEFAULT_CLOCK_FORMAT = '%H:%M:%S'
 DEFAULT_DATE_FORMAT  = '%A %d %B'
 SESSION_LAST_USED    = '#last'
+SESSION_START_TIMEOUT = 60
+LOG_FORMAT           = ('+%(relativeCreated)dms [%(module)s] %(levelname)s '
+        '%(message)s')
+DEFAULT_LOG_LEVEL    = 'debug'
+USERNAME_COMPLETION_LIMIT = 10
+LOGIND_BUS_NAME      = 'org.freedesktop.login1'
+LOGIND_OBJECT_PATH   = '/org/freedesktop/login1'
+LOGIND_MANAGER_INTERFACE = 'org.freedesktop.login1.Manager'
+# logind methods answering whether each power action is available
+LOGIND_POWER_METHODS = {
+    'suspend': 'CanSuspend',
+    'hibernate': 'CanHibernate',
+    'restart': 'CanReboot',
+    'shutdown': 'CanPowerOff'
+}
+LOG_LEVEL_ENVIRONMENT_VARIABLE = 'LIGHTDM_KBSWITCH_GREETER_LOG_LEVEL'
+
+# Clock updates
+CLOCK_RESOLUTION_SECOND  = 1
+CLOCK_RESOLUTION_MINUTE  = 60
+CLOCK_RESOLUTION_HOUR    = 3600
+CLOCK_RESOLUTION_DAY     = 86400
+CLOCK_MAX_INTERVAL       = 60
+CLOCK_CONVERSIONS_MINUTE = 'MR'
+CLOCK_CONVERSIONS_HOUR   = 'HIklpPzZ'
+CLOCK_CONVERSIONS_DAY    = 'aAbBCdDeFgGhjmntuUVwWxyY%'
 
 # mlockall flags
 MCL_CURRENT = 1
 MCL_FUTURE = 2
 
+# memory-lock modes
+MEMORY_LOCK_ALL     = 'all'
+MEMORY_LOCK_SECRETS = 'secrets'
+MEMORY_LOCK_NONE    = 'none'
+
 session_settings = dict()
 login_window = None
 
 clock = None
 clock_format = None
+clock_resolution = None
+clock_source = None
 date = None
 date_format = None
 
@@ -62,6 +111,8 @@ language_menubutton = None
 language_menu = None
 keyboard_menubutton = None
 keyboard_menu = None
+layout_index = None
+layout_controller = None
 session_menubutton = None
 session_menu = None
 a11y_menubutton = None
@@ -73,12 +124,17 @@ hibernate_menuitem = None
 restart_menuitem = None
 shutdown_menuitem = None
 
+power_capabilities = dict()
+power_refresh_pending = 0
+system_bus = None
+
 username_entry = None
 password_entry = None
 
 message_box = None
 message_icon = None
 message_text = None
+message_spinner = None
 
 power_window = None
 power_title = None
@@ -94,10 +150,55 @@ default_icon_theme_name = None
 default_font_name = None
 
 greeter_config = None
+greeter_surface = None
+user_directory = None
+accounts_cache = None
+
+daemon_connected = False
+login_pending = False
+authentication_user = None
+secret_prompt_pending = False
+password_submitted = False
+authenticated_time = None
+session_start_cancellable = None
+session_start_timeout = None
+
+startup_trace = None
 
 # Helper functions
 libc = ctypes.CDLL('libc.so.6', use_errno=True)
 
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Hands log records to the writer thread without formatting them, so
+    neither formatting nor writing happens on the main thread"""
+    def prepare(self, record):
+        return record
+
+
+def init_logging():
+    """Write log records to stderr from a background thread
+
+    stderr is LightDM's log file, so a slow disk would otherwise hold up
+    input handling."""
+    log_queue = queue.Queue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logging.getLogger().addHandler(LogQueueHandler(log_queue))
+    set_log_level(os.environ.get(
+            LOG_LEVEL_ENVIRONMENT_VARIABLE, DEFAULT_LOG_LEVEL))
+
+
+def set_log_level(name: str) -> None:
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        logging.warning("Unknown log level '%s'", name)
+        return
+    logging.getLogger().setLevel(level)
+
+
 def mlockall(flags=MCL_CURRENT|MCL_FUTURE):
     result = libc.mlockall(flags)
     if result != 0:
@@ -105,28 +206,160 @@ def mlockall(flags=MCL_CURRENT|MCL_FUTURE):
                 ctypes.get_errno()))
 
 
-def draw_clock():
-    clock.set_text(strftime(clock_format))
-    date.set_text(strftime(date_format))
+def get_process_memory(field: str) -> int:
+    """Number of bytes for a memory field of /proc/self/status, e.g. VmRSS"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def get_locked_memory() -> int:
+    """Number of bytes of memory locked by the process"""
+    return get_process_memory('VmLck')
+
+
+def count_menu_items(menu: Gtk.Menu) -> int:
+    count = 0
+    for i in menu.get_children():
+        count += 1
+        if i.get_submenu():
+            count += count_menu_items(i.get_submenu())
+    return count
+
+
+def count_greeter_sources() -> dict:
+    """Number of main loop sources the greeter has added, by purpose"""
+    return {
+            'clock': 1 if clock_source else 0,
+            'menu fills': sum(1 for i in (language_menu, keyboard_menu)
+                    if not i.populated),
+            'layout switch': layout_controller.pending_sources,
+            'monitors': greeter_surface.pending_sources,
+            'background loads': greeter_surface.pixbuf_cache.pending,
+            'session start timeout': 1 if session_start_timeout else 0
+            }
+
+
+def log_state(msg: str, *args) -> None:
+    """Log msg whatever the log level, for the state dump"""
+    logger = logging.getLogger()
+    logger.handle(logger.makeRecord(logger.name, logging.INFO, __file__, 0,
+            msg, args, None))
+
+
+def use_secure_password_buffer(entry: Gtk.Entry) -> bool:
+    """Keep the text of entry in locked, non-pageable memory that is wiped
+    when freed. Returns False if gcr is not available to provide it"""
+    try:
+        gi.require_version('GcrUi', '3')
+        from gi.repository import GcrUi
+    except (ValueError, ImportError):
+        return False
+    entry.set_buffer(GcrUi.SecureEntryBuffer.new())
     return True
 
 
-def get_layout_region(layout: LightDM.Layout) -> str:
-    return layout.get_name().split()[0]
+def get_format_resolution(time_format: str) -> int:
+    """Return the number of seconds between changes to the text strftime
+    produces for time_format"""
+    resolution = CLOCK_RESOLUTION_DAY
+    pos = time_format.find('%')
+    while pos != -1:
+        pos += 1
+        # Skip glibc flags, field width and E or O modifiers
+        while (pos < len(time_format) and
+                time_format[pos] in '_-0^#123456789EO'):
+            pos += 1
+        if pos == len(time_format): break
+        conversion = time_format[pos]
+        if conversion in CLOCK_CONVERSIONS_DAY:
+            pass
+        elif conversion in CLOCK_CONVERSIONS_HOUR:
+            resolution = min(resolution, CLOCK_RESOLUTION_HOUR)
+        elif conversion in CLOCK_CONVERSIONS_MINUTE:
+            resolution = min(resolution, CLOCK_RESOLUTION_MINUTE)
+        else:
+            # Seconds or a conversion that is not known
+            return CLOCK_RESOLUTION_SECOND
+        pos = time_format.find('%', pos + 1)
+    return resolution
+
+
+def load_resources() -> bool:
+    """Register the bundle of interface, CSS and icons so they can be loaded
+    from one memory-mapped file. Returns False if the separate files need to
+    be used instead, e.g. when running from the source tree"""
+    try:
+        resource = Gio.Resource.load(RESOURCE_FILE)
+    except GLib.Error as e:
+        m = "Could not load resource bundle '%s': %s. Using separate files"
+        logging.debug(m, RESOURCE_FILE, e.message)
+        return False
+    Gio.resources_register(resource)
+    return True
+
+
+def draw_clock():
+    # Setting the same text still causes a relayout so avoid it
+    text = strftime(clock_format)
+    if text != clock.get_text():
+        clock.set_text(text)
+    text = strftime(date_format)
+    if text != date.get_text():
+        date.set_text(text)
+
+
+def schedule_clock():
+    """Redraw the clock when its text will next change"""
+    now = time.time()
+    local = time.localtime(now)
+    since_midnight = (local.tm_hour * 3600 + local.tm_min * 60 +
+            local.tm_sec + now % 1)
+    delay = clock_resolution - since_midnight % clock_resolution
+    # Wake up regularly anyway in case the system clock is changed
+    delay = min(delay, CLOCK_MAX_INTERVAL)
+    global clock_source
+    clock_source = GLib.timeout_add(int(delay * 1000) + 1, clock_timeout_cb)
+
+
+def clock_timeout_cb():
+    global clock_source
+    clock_source = None
+    draw_clock()
+    schedule_clock()
+    return False
+
+
+def new_layout_menu_item(
+        layout: LightDM.Layout,
+        group: Gtk.RadioMenuItem
+        ) -> Gtk.RadioMenuItem:
+    menu_item = Gtk.RadioMenuItem.new_with_label(
+            None, layout_index.get_description(layout))
+    menu_item.lightdm_layout = layout
+    menu_item.connect('activate', change_keyboard_layout_cb)
+    menu_item.join_group(group)
+    return menu_item
 
 
 def generate_layout_menu_items(
-        default_layout: LightDM.Layout
+        default_layout: LightDM.Layout,
+        selected_layout: LightDM.Layout
         ) -> Generator[Gtk.RadioMenuItem, Any, None]:
-    layout_choices = set()
+    layout_choices = dict()
 
     kl = greeter_config.get('keyboard-layouts', None)
     if kl:
-        layout_names = set()
         for i in kl.split(';'):
-            if i: layout_names.add("\t".join(i.split()))
-        lf = lambda l, lns=layout_names: l.get_name() in lns
-        layout_choices = set(filter(lf, LightDM.get_layouts()))
+            if not i: continue
+            layout = layout_index.get("\t".join(i.split()))
+            if layout:
+                layout_choices[layout.get_name()] = layout
 
     lr = greeter_config.get('keyboard-layout-regions', None)
     if lr:
@@ -134,34 +367,26 @@ def generate_layout_menu_items(
         for i in lr.split(';'):
             if i: layout_regions.add(i.strip())
 
-        if default_layout not in layout_choices:
+        if default_layout.get_name() not in layout_choices:
             # Regions are being used to add groups of layouts. If the default
             # layout's region has not been explicitly added then add its group
             # for consistency
             layout_regions.add(get_layout_region(default_layout))
 
-        rf = lambda l, lrs=layout_regions: get_layout_region(l) in lrs
-        layout_choices = layout_choices.union(filter(rf, LightDM.get_layouts()))
+        for region in layout_regions:
+            for layout in layout_index.get_region(region):
+                layout_choices[layout.get_name()] = layout
 
     # For sanity, make sure default layout is always in the set
-    layout_choices.add(default_layout)
+    layout_choices[default_layout.get_name()] = default_layout
 
     regions_items = dict()
     last_item = None
-    for l in sorted(layout_choices, key=lambda lo: lo.get_name()):
+    for name in sorted(layout_choices.keys()):
+        l = layout_choices[name]
         region = get_layout_region(l)
-        l_desc = l.get_description()
-        if region == l.get_name():
-            # Switch countries and languages where language is written first
-            pos = l_desc.find(' (')
-            if pos != -1:
-                l_desc = '{0} ({1})'.format(l_desc[pos+2:-1], l_desc[:pos])
-
-        menu_item = Gtk.RadioMenuItem.new_with_label(None, l_desc)
-        menu_item.lightdm_layout = l
-        menu_item.connect('activate', change_keyboard_layout_cb)
-        menu_item.join_group(last_item)
-        if l == LightDM.get_layout(): menu_item.activate()
+        menu_item = new_layout_menu_item(l, last_item)
+        if name == selected_layout.get_name(): menu_item.activate()
 
         if region not in regions_items:
             regions_items[region] = []
@@ -189,6 +414,168 @@ def get_language_description(language: LightDM.Language) -> str:
             language.get_name(), language.get_territory(), language.get_code())
 
 
+def new_language_menu_item(
+        language: LightDM.Language,
+        group: Gtk.RadioMenuItem
+        ) -> Gtk.RadioMenuItem:
+    menu_item = Gtk.RadioMenuItem.new_with_label(
+            None, get_language_description(language))
+    menu_item.lightdm_language = language
+    menu_item.connect('activate', select_language_cb)
+    menu_item.join_group(group)
+    return menu_item
+
+
+def populate_language_menu(menu: Gtk.Menu) -> None:
+    selected = session_settings.get('language', LightDM.get_language())
+    for i in menu.get_children():
+        i.destroy()
+
+    row = 0
+    last_item = None
+    for i in LightDM.get_languages():
+        menu_item = new_language_menu_item(i, last_item)
+        if i == selected: menu_item.activate()
+        menu.attach(menu_item, 0, 1, row, row+1)
+        row += 1
+        last_item = menu_item
+
+
+def populate_keyboard_menu(menu: Gtk.Menu) -> None:
+    for i in menu.get_children():
+        i.destroy()
+
+    row = 0
+    # Nothing can have been selected before the menu is populated so the
+    # default layout is still the current one
+    for menu_item in generate_layout_menu_items(
+            session_settings['default_layout'],
+            session_settings['default_layout']):
+        menu.attach(menu_item, 0, 1, row, row+1)
+        row += 1
+
+
+def populate_menu_on_demand(menu: Gtk.Menu, populate) -> None:
+    """Call populate(menu) the first time menu is shown, or once the main loop
+    is idle, whichever comes first
+
+    Large menus are not needed to show the login window so this keeps them
+    off the startup path. Until then the menu should hold only its selected
+    item.
+    """
+    menu.populated = False
+    menu.populate = populate
+    # Gtk.Menu.show_all() only shows the items, the menu itself is shown, and
+    # so emits show, each time it pops up
+    menu.populate_handler = menu.connect('show', populate_menu)
+    GLib.idle_add(populate_menu, menu, priority=GLib.PRIORITY_LOW)
+
+
+def populate_menu(menu, *args):
+    if not menu.populated:
+        menu.populated = True
+        menu.disconnect(menu.populate_handler)
+        with greeter_trace.span(menu.populate.__name__):
+            menu.populate(menu)
+            menu.show_all()
+    return False
+
+
+def init_session_menu(lightdm_greeter):
+    trace_token = greeter_trace.begin('session menu')
+    default_session = greeter_config.get(
+            'default-session', str(lightdm_greeter.get_default_session_hint()))
+
+    menu_item = Gtk.RadioMenuItem.new_with_label(None, 'Last used session')
+    menu_item.lightdm_session_key = SESSION_LAST_USED
+    menu_item.connect('activate', select_session_cb)
+    menu_item.join_group(None)
+    session_menu.attach(menu_item, 0, 1, 0, 1)
+    # Make sure first item is selected in case default-session is not properly
+    # defined in configuration
+    menu_item.activate()
+
+    last_item = menu_item
+    row = 1
+    for i in LightDM.get_sessions():
+        menu_item = Gtk.RadioMenuItem.new_with_label(None, i.get_name())
+        menu_item.lightdm_session_key = i.get_key()
+        menu_item.connect('activate', select_session_cb)
+        menu_item.join_group(last_item)
+        session_menu.attach(menu_item, 0, 1, row, row+1)
+        if default_session.lower() == i.get_key().lower():
+            menu_item.activate()
+            session_settings['default_session'] = i.get_key()
+        row += 1
+        last_item = menu_item
+    session_menu.show_all()
+    session_menubutton.set_popup(session_menu)
+    session_menubutton.set_sensitive(True)
+    greeter_trace.end(trace_token)
+
+
+def update_power_menu():
+    """Set the power menu items from the cached capabilities. Items stay
+    insensitive until the capabilities are known"""
+    for capability, menu_item in (
+            ('suspend', suspend_menuitem),
+            ('hibernate', hibernate_menuitem),
+            ('restart', restart_menuitem),
+            ('shutdown', shutdown_menuitem)):
+        menu_item.set_sensitive(power_capabilities.get(capability, False))
+
+
+def refresh_power_capabilities(*args):
+    """Ask logind for the power capabilities without blocking"""
+    global power_refresh_pending
+    if not system_bus or power_refresh_pending: return False
+    power_refresh_pending = len(LOGIND_POWER_METHODS)
+    for capability, method in LOGIND_POWER_METHODS.items():
+        system_bus.call(LOGIND_BUS_NAME, LOGIND_OBJECT_PATH,
+                LOGIND_MANAGER_INTERFACE, method, None,
+                GLib.VariantType.new('(s)'), Gio.DBusCallFlags.NONE, -1,
+                None, power_capability_cb, capability)
+    return False
+
+
+def power_capability_cb(connection, result, capability):
+    global power_refresh_pending
+    power_refresh_pending -= 1
+    try:
+        can = connection.call_finish(result).unpack()[0] == 'yes'
+    except GLib.Error as e:
+        # LightDM also knows how to ask ConsoleKit and UPower
+        logging.debug('Could not ask logind whether the system can %s: %s',
+                capability, e.message)
+        can = getattr(LightDM, 'get_can_' + capability)()
+    set_power_capability(capability, can)
+
+
+def set_power_capability(capability, can):
+    if power_capabilities.get(capability, None) != can:
+        logging.debug('Can %s: %s', capability, can)
+        power_capabilities[capability] = can
+        update_power_menu()
+
+
+def system_bus_cb(source, result, user_data):
+    global system_bus
+    try:
+        system_bus = Gio.bus_get_finish(result)
+    except GLib.Error as e:
+        logging.debug('Could not connect to system bus: %s', e.message)
+        for capability in LOGIND_POWER_METHODS:
+            set_power_capability(capability,
+                    getattr(LightDM, 'get_can_' + capability)())
+        return
+    # Refresh the power capabilities when logind's state changes
+    system_bus.signal_subscribe(LOGIND_BUS_NAME,
+            'org.freedesktop.DBus.Properties', 'PropertiesChanged',
+            LOGIND_OBJECT_PATH, None, Gio.DBusSignalFlags.NONE,
+            refresh_power_capabilities, None)
+    refresh_power_capabilities()
+
+
 def resize_icons(icon_size):
     for i in (
             language_menubutton, keyboard_menubutton, session_menubutton,
@@ -207,8 +594,22 @@ def show_message(text, message_type=None):
         icon_name = 'dialog-error-symbolic'
     if icon_theme.has_icon(icon_name):
         message_icon.set_from_icon_name(icon_name, Gtk.IconSize.DIALOG)
-                
-    message_box.show_all()
+
+    message_spinner.stop()
+    message_spinner.hide()
+    message_icon.show()
+    message_text.show()
+    message_box.show()
+
+
+def show_busy(text):
+    """Show text with a spinner in place of the message icon"""
+    message_text.set_text(text)
+    message_icon.hide()
+    message_spinner.show()
+    message_spinner.start()
+    message_text.show()
+    message_box.show()
 
 
 def clear_entry():
@@ -229,7 +630,7 @@ def select_language_cb(widget):
 
 
 def change_keyboard_layout_cb(widget):
-    LightDM.set_layout(widget.lightdm_layout)
+    layout_controller.set_layout(widget.lightdm_layout)
 
 
 def select_session_cb(menu_item):
@@ -297,10 +698,9 @@ def a11y_contrast_cb(menu_item):
 
 
 def power_menu_cb(widget):
-    suspend_menuitem.set_sensitive(LightDM.get_can_suspend())
-    hibernate_menuitem.set_sensitive(LightDM.get_can_hibernate())
-    restart_menuitem.set_sensitive(LightDM.get_can_restart())
-    shutdown_menuitem.set_sensitive(LightDM.get_can_shutdown())
+    update_power_menu()
+    # Pick up any change for the next time the menu is opened
+    refresh_power_capabilities()
 
 
 def suspend_cb(widget):
@@ -343,7 +743,7 @@ def reset_login_cb(widget):
                 break
 
     for i in session_menu.get_children():
-        if i.lightdm_session_key == session_settings['default_session']:
+        if i.lightdm_session_key == session_settings.get('default_session'):
             i.activate()
             break
     clear_entry_cb(widget)
@@ -353,8 +753,90 @@ def clear_entry_cb(widget):
     clear_entry()
 
 
+def init_username_completion():
+    """Complete the user name from the users LightDM knows about"""
+    completion = Gtk.EntryCompletion()
+    completion.set_model(Gtk.ListStore(str))
+    completion.set_text_column(0)
+    # The model only ever holds matches, see username_changed_cb
+    completion.set_match_func(lambda *args: True, None)
+    # Fill the model before the completion handles the change
+    username_entry.connect('changed', username_changed_cb)
+    username_entry.set_completion(completion)
+    return False
+
+
+def username_changed_cb(widget):
+    model = widget.get_completion().get_model()
+    model.clear()
+    # There are no suggestions until the user cache has been started after
+    # the first frame, and only those users read so far until it is filled
+    if not accounts_cache: return
+    for name in accounts_cache.complete(
+            widget.get_text(), USERNAME_COMPLETION_LIMIT):
+        model.append((name,))
+
+
+def start_authentication():
+    """Start authenticating the user name entered so PAM is set up while the
+    password is being typed"""
+    global authentication_user
+    global secret_prompt_pending
+    username = username_entry.get_text()
+    if not daemon_connected or username == authentication_user: return
+    if not username and not password_submitted: return
+    if authentication_user is not None:
+        greeter.cancel_authentication()
+    logging.debug('Starting authentication')
+    authentication_user = username
+    secret_prompt_pending = False
+    greeter.authenticate(username)
+
+
+def cancel_authentication():
+    global authentication_user
+    global secret_prompt_pending
+    global password_submitted
+    if authentication_user is None: return
+    logging.debug('Cancelling authentication')
+    authentication_user = None
+    secret_prompt_pending = False
+    password_submitted = False
+    greeter.cancel_authentication()
+
+
+def submit_password():
+    """Answer the password prompt, or have it answered as soon as it is
+    shown"""
+    global password_submitted
+    global secret_prompt_pending
+    password_submitted = True
+    start_authentication()
+    if greeter.get_is_authenticated():
+        # PAM did not need a password
+        password_submitted = False
+        try_start_session(greeter)
+    elif secret_prompt_pending:
+        logging.debug('Sending password')
+        secret_prompt_pending = False
+        greeter.respond(password_entry.get_text())
+
+
+def username_edited_cb(widget):
+    if widget.get_text() != authentication_user:
+        cancel_authentication()
+
+
+def password_focus_in_event_cb(widget, event):
+    # The user name only counts as entered once the user moves on to the
+    # password, not when focus leaves it for a menu or another monitor
+    start_authentication()
+    return False
+
+
 def username_key_press_event_cb(widget, event):
     if event.keyval == Gdk.KEY_Return:
+        start_authentication()
         password_entry.grab_focus()
         return True
 
@@ -368,21 +850,31 @@ def password_key_press_event_cb(widget, event):
 def login_cb(widget):
     logging.debug('Login button clicked')
     login_window.set_sensitive(False)
-    greeter.authenticate(username_entry.get_text())
+    # The session inherits the layout so make sure it has been set
+    layout_controller.flush()
+    if not daemon_connected:
+        global login_pending
+        logging.debug('Waiting for connection to LightDM daemon')
+        login_pending = True
+        return
+    submit_password()
 
 # Power prompt UI
 
 
+def get_user_directory() -> greeter_users.UserDirectory:
+    global user_directory
+    if not user_directory:
+        user_directory = greeter_users.UserDirectory()
+    return user_directory
+
+
 def show_power_prompt(action, icon_name):
     title = action.capitalize()
     message = ('Are you sure you want to close all programs and {0} the '
             'computer?').format(action)
 
-    logged_in_users = 0
-    for i in LightDM.UserList.get_users(LightDM.UserList.get_instance()):
-        if i.get_logged_in():
-            logged_in_users += 1
-
+    logged_in_users = get_user_directory().logged_in_count
     if logged_in_users > 0:
         if logged_in_users == 1:
             warning = 'There is still 1 user logged in'
@@ -442,6 +934,71 @@ def screen_overlay_get_child_position_cb(widget, allocation, user_data):
     # TODO: this method should position floating widgets not using halign and valign
     return
 
+def dump_state_cb():
+    """Log what the greeter is holding in memory, on SIGUSR1. This is
+    written whatever the log level is set to"""
+    log_state('State dump: RSS %d bytes, %d bytes locked',
+            get_process_memory('VmRSS'), get_locked_memory())
+
+    cache = greeter_surface.pixbuf_cache
+    entries = cache.entries()
+    log_state('State dump: background cache holds %d images, %d bytes '
+            '(%s)', len(entries), cache.size, cache.stats)
+    for key, size, users in entries:
+        log_state('State dump:   %s: %d bytes, used by %d monitors',
+                key, size, users)
+
+    monitors = greeter_surface.monitors
+    log_state('State dump: %d monitors, %d with windows', len(monitors),
+            sum(1 for i in monitors if i.is_enabled))
+    log_state('State dump: interface %s', greeter_surface.stats)
+    log_state('State dump: menu items: language %d, keyboard %d, '
+            'session %d', count_menu_items(language_menu),
+            count_menu_items(keyboard_menu), count_menu_items(session_menu))
+    log_state('State dump: main loop sources added by the greeter: %s',
+            count_greeter_sources())
+    return True
+
+
+def terminate_cb():
+    logging.debug('Terminated')
+    loop = getattr(power_window, 'loop', None)
+    if loop and loop.is_running():
+        # The power prompt runs its own main loop, which Gtk.main_quit() does
+        # not stop. Cancel it so that no power action is taken
+        power_button_clicked_cb(power_cancel_button)
+    Gtk.main_quit()
+    return False
+
+
+def first_draw_cb(widget, cr):
+    widget.disconnect(widget.first_draw_handler)
+    greeter_trace.end(widget.first_draw_trace)
+    greeter_trace.end(startup_trace)
+    logging.debug('%d bytes locked after first frame', get_locked_memory())
+    # Read the users' last sessions once the login window is up, so that
+    # starting a session does not have to ask AccountsService
+    GLib.idle_add(load_accounts_cache_cb, priority=GLib.PRIORITY_LOW)
+    # Write the trace once the frame has been finished and the menus have
+    # been filled, which is done at the same low priority
+    GLib.idle_add(trace_finish_cb, priority=GLib.PRIORITY_LOW)
+    return False
+
+
+def trace_finish_cb():
+    if not (language_menu.populated and keyboard_menu.populated):
+        # Keep recording until the menu fills have been traced
+        return True
+    greeter_trace.finish()
+    return False
+
+
+def load_accounts_cache_cb():
+    global accounts_cache
+    accounts_cache = greeter_users.AccountsCache()
+    accounts_cache.load()
+    return False
+
 # end of Gtk callbacks
 
 # Gtk signal handlers
@@ -457,6 +1014,8 @@ handlers = {
     'clear_entry_cb': clear_entry_cb,
     'login_cb': login_cb,
     'username_key_press_event_cb': username_key_press_event_cb,
+    'username_edited_cb': username_edited_cb,
+    'password_focus_in_event_cb': password_focus_in_event_cb,
     'password_key_press_event_cb': password_key_press_event_cb,
     'power_window_key_press_event_cb': power_window_key_press_event_cb,
     'power_button_clicked_cb': power_button_clicked_cb,
@@ -465,55 +1024,149 @@ handlers = {
 
 # LightDM callbacks
 
+def daemon_connected_cb(lightdm_greeter, result, trace_token):
+    global daemon_connected
+    global login_pending
+    greeter_trace.end(trace_token)
+    try:
+        lightdm_greeter.connect_to_daemon_finish(result)
+    except GLib.Error as e:
+        logging.error('Could not connect to LightDM daemon: %s', e.message)
+        Gtk.main_quit()
+        return
+    logging.debug('Connected to LightDM daemon')
+    daemon_connected = True
+    init_session_menu(lightdm_greeter)
+    if login_pending:
+        login_pending = False
+        submit_password()
+
+
 def show_message_cb(lightdm_greeter, text, message_type):
     logging.debug('Recieved %s message', message_type)
     show_message(text, message_type)
 
 
 def try_start_session(lightdm_greeter):
+    global authenticated_time
+    global session_start_cancellable
+    global session_start_timeout
+    if session_start_cancellable:
+        logging.debug('Session is already being started')
+        return
     logging.debug('Try to start session')
+    if authenticated_time is None:
+        authenticated_time = time.monotonic()
     if 'language' in session_settings:
         lightdm_greeter.set_language(session_settings['language'].get_code())
-    if session_settings['session'] == SESSION_LAST_USED:
-        logging.debug('Try to use last session')
-        user_list = LightDM.UserList.get_instance()
-        user = user_list.get_user_by_name(lightdm_greeter.get_authentication_user())
-        logging.debug('User: %s', str(user))
-        session = user.get_session()
-        m = 'Session for user %s is %s'
-        logging.debug(m, user.get_name(), session)
-    else:
+
+    show_busy(_('Starting session'))
+    session_start_cancellable = Gio.Cancellable()
+    session_start_timeout = GLib.timeout_add_seconds(
+            SESSION_START_TIMEOUT, session_start_timeout_cb)
+
+    if session_settings['session'] != SESSION_LAST_USED:
         session = session_settings['session']
         logging.debug('Session is %s', session)
+        request_session_start(lightdm_greeter, session)
+        return
 
-    if not lightdm_greeter.start_session_sync(session):
-        logging.debug("Failed to start session '%s'", session)
+    logging.debug('Try to use last session')
+    username = lightdm_greeter.get_authentication_user()
+    session = None
+    if accounts_cache:
+        session = accounts_cache.get_session(username)
+    if session:
+        logging.debug('Session for user %s is %s', username, session)
+    else:
+        # LightDM starts the user's last session when none is given
+        logging.debug('Last session for user %s not known, leaving the '
+                'session to LightDM', username)
+    request_session_start(lightdm_greeter, session)
+
+
+def request_session_start(lightdm_greeter, session):
+    lightdm_greeter.start_session(session, session_start_cancellable,
+            session_started_cb, session)
+
+
+def session_started_cb(lightdm_greeter, result, session):
+    global authenticated_time
+    global session_start_cancellable
+    global session_start_timeout
+    if session_start_timeout:
+        GLib.source_remove(session_start_timeout)
+        session_start_timeout = None
+    session_start_cancellable = None
+    elapsed = (time.monotonic() - authenticated_time) * 1000
+    try:
+        started = lightdm_greeter.start_session_finish(result)
+    except GLib.Error as e:
+        logging.debug('Could not start session: %s', e.message)
+        started = False
+    if not started:
+        logging.debug("Failed to start session '%s' after %.1fms", session,
+                elapsed)
         show_message(_('Failed to start session'))
         login_window.set_sensitive(True)
+        authenticated_time = None
+        return
+    logging.debug("Session '%s' started %.1fms after authentication",
+            session, elapsed)
+
+
+def session_start_timeout_cb():
+    global session_start_timeout
+    session_start_timeout = None
+    logging.debug('Session did not start within %ds', SESSION_START_TIMEOUT)
+    # session_started_cb reports the failure
+    session_start_cancellable.cancel()
+    return False
 
 
 def show_prompt_cb(lightdm_greeter, text, prompt_type):
+    global secret_prompt_pending
     if lightdm_greeter.get_in_authentication():
         not_in_auth = ''
     else:
         not_in_auth = 'not '
     m = 'Prompt request for %s. Currently %sin authentication'
-    logging.debug(m, str(prompt_type), not_in_auth)
+    logging.debug(m, prompt_type, not_in_auth)
 
     if lightdm_greeter.get_is_authenticated():
         try_start_session(lightdm_greeter)
     elif (prompt_type == LightDM.PromptType.SECRET and
             lightdm_greeter.get_in_authentication()):
-        logging.debug('Sending password')
-        lightdm_greeter.respond(password_entry.get_text())
+        if password_submitted:
+            logging.debug('Sending password')
+            lightdm_greeter.respond(password_entry.get_text())
+        else:
+            logging.debug('Waiting for password')
+            secret_prompt_pending = True
 
 
 def authentication_complete_cb(greeter):
+    global authentication_user
+    global authenticated_time
+    global password_submitted
+    if not password_submitted:
+        if greeter.get_is_authenticated():
+            logging.debug('User authenticated, waiting for login')
+            authenticated_time = time.monotonic()
+        else:
+            # Cancelled, or PAM gave up before a password was given
+            logging.debug('Authentication ended before login')
+            authentication_user = None
+        return
+
+    password_submitted = False
     if greeter.get_is_authenticated():
+        authenticated_time = time.monotonic()
         logging.debug('User authenticated, starting session')
         try_start_session(greeter)
     else:
         logging.debug('Login failed')
+        authentication_user = None
         show_message(_('Login failed'))
         clear_entry()
         login_window.set_sensitive(True)
@@ -526,6 +1179,7 @@ def run():
 
     global clock 
     global clock_format 
+    global clock_resolution
     global date 
     global date_format 
 
@@ -533,6 +1187,8 @@ def run():
     global language_menu 
     global keyboard_menubutton 
     global keyboard_menu 
+    global layout_index
+    global layout_controller
     global session_menubutton 
     global session_menu 
     global a11y_menubutton 
@@ -550,6 +1206,7 @@ def run():
     global message_box 
     global message_icon 
     global message_text 
+    global message_spinner
 
     global power_window 
     global power_title 
@@ -564,6 +1221,10 @@ def run():
     global default_font_name 
 
     global greeter_config
+    global greeter_surface
+
+    global startup_trace
+    startup_trace = greeter_trace.begin('startup')
 
     locale.setlocale(locale.LC_ALL, '')
     # allow Gtk.Builder to use translations for gettext
@@ -571,15 +1232,7 @@ def run():
     gettext.bindtextdomain(APP_NAME, LOCALE_DIR)
     gettext.textdomain(APP_NAME)
 
-    logging.basicConfig(level=logging.DEBUG,
-            format=('+%(relativeCreated)dms [%(module)s] %(levelname)s '
-                    '%(message)s'))
-
-    # Prevent memory from being swapped out, as we are dealing with passwords
-    try:
-        mlockall()
-    except Exception as e:
-        logging.debug(str(e.args[0]))
+    init_logging()
 
     # LP: #1024882
     # https://bugs.launchpad.net/bugs/1024482
@@ -595,11 +1248,28 @@ def run():
     greeter.connect('authentication-complete', authentication_complete_cb)
     greeter.connect('show-message', show_message_cb)
     greeter.connect('show-prompt', show_prompt_cb)
-    greeter.connect_to_daemon_sync()
+    # The rest of the interface is set up while the daemon replies
+    greeter.connect_to_daemon(None, daemon_connected_cb,
+            greeter_trace.begin('connect_to_daemon'))
 
     full_config = ConfigParser()
-    full_config.read(CONFIG_FILE)
+    with greeter_trace.span('ConfigParser.read'):
+        full_config.read(CONFIG_FILE)
     greeter_config = full_config[CONFIG_GROUP_DEFAULT]
+    if (greeter_config.get('log-level', None) and
+            not os.environ.get(LOG_LEVEL_ENVIRONMENT_VARIABLE, None)):
+        set_log_level(greeter_config['log-level'])
+
+    # Prevent memory from being swapped out, as we are dealing with passwords
+    memory_lock = greeter_config.get('memory-lock', MEMORY_LOCK_ALL)
+    if memory_lock not in (MEMORY_LOCK_SECRETS, MEMORY_LOCK_NONE):
+        try:
+            mlockall()
+        except Exception as e:
+            logging.debug(str(e.args[0]))
+
+    if greeter_config.get('trace-file', None):
+        greeter_trace.set_trace_file(greeter_config['trace-file'])
 
     # Set clock and date strings
     clock_format = greeter_config.get('clock-format', DEFAULT_CLOCK_FORMAT)
@@ -643,11 +1313,21 @@ def run():
     if greeter_config.get('xft-rgba', None):
         gtk_settings.set_property('gtk-xft-rgba', greeter_config['xft-rgba'])
 
+    with greeter_trace.span('load_resources'):
+        use_resources = load_resources()
+
     icon_theme = Gtk.IconTheme.get_default()
+    if use_resources:
+        icon_theme.add_resource_path(ICON_RESOURCE_PATH)
 
     # Import the interface
     builder = Gtk.Builder()
-    builder.add_from_file(UI_FILE)
+    if use_resources:
+        with greeter_trace.span('Gtk.Builder.add_from_resource'):
+            builder.add_from_resource(UI_RESOURCE)
+    else:
+        with greeter_trace.span('Gtk.Builder.add_from_file'):
+            builder.add_from_file(UI_FILE)
     builder.connect_signals(handlers)
 
     # Login window
@@ -655,6 +1335,20 @@ def run():
     login_box = builder.get_object('login_box')
     username_entry = builder.get_object('username_entry')
     password_entry = builder.get_object('password_entry')
+    if memory_lock == MEMORY_LOCK_SECRETS:
+        # Only the password is locked, the rest of the greeter can be swapped
+        if not use_secure_password_buffer(password_entry):
+            logging.debug('Secure memory for the password is not available '
+                    '(gcr is not installed). Locking all memory instead')
+            memory_lock = MEMORY_LOCK_ALL
+            try:
+                mlockall()
+            except Exception as e:
+                logging.debug(str(e.args[0]))
+    logging.debug('Memory lock mode is %s, %d bytes locked',
+            memory_lock, get_locked_memory())
+    if greeter_config.getboolean('username-completion', False):
+        GLib.idle_add(init_username_completion, priority=GLib.PRIORITY_LOW)
     session_controls = builder.get_object('session_controls')
 
     # Login window: Hostname and clock
@@ -662,10 +1356,14 @@ def run():
     hostname_label.set_text(LightDM.get_hostname())
     clock = builder.get_object('clock')
     date = builder.get_object('date')
+    clock_resolution = min(get_format_resolution(clock_format),
+            get_format_resolution(date_format))
+    logging.debug('Clock resolution is %ds', clock_resolution)
     draw_clock()
-    GLib.timeout_add_seconds(1, draw_clock)
+    schedule_clock()
 
     # Login window: initialise language menu
+    trace_token = greeter_trace.begin('language menu')
     language_menubutton = builder.get_object('language_menubutton')
     language_menu = builder.get_object('language_menu')
 
@@ -678,38 +1376,38 @@ def run():
     image.show()
     language_menubutton.add(image)
 
-    row = 0
-    last_item = None
-    for i in LightDM.get_languages():
-        menu_item = Gtk.RadioMenuItem.new_with_label(
-                            None, get_language_description(i))
-        menu_item.lightdm_language = i
-        menu_item.connect('activate', select_language_cb)
-        menu_item.join_group(last_item)
-        if i == LightDM.get_language(): menu_item.activate()
-        language_menu.attach(menu_item, 0, 1, row, row+1)
-        row += 1
-        last_item = menu_item
-    
+    # Only the current language until the menu is populated
+    current_language = LightDM.get_language()
+    if current_language:
+        menu_item = new_language_menu_item(current_language, None)
+        menu_item.activate()
+        language_menu.attach(menu_item, 0, 1, 0, 1)
+    populate_menu_on_demand(language_menu, populate_language_menu)
+
     language_menu.show_all()
     language_menubutton.set_popup(language_menu)
+    greeter_trace.end(trace_token)
 
     # Login window: initialise keyboard menu
+    trace_token = greeter_trace.begin('keyboard menu')
+    layout_index = greeter_keyboard.LayoutIndex()
 
     # LightDM.get_layout() resets the keyboard layout to default
     # so only call this once
     session_settings['default_layout'] = LightDM.get_layout()
+    layout_controller = greeter_keyboard.LayoutController(
+            session_settings['default_layout'])
     dkl = greeter_config.get('default-keyboard-layout', None)
     if dkl:
         logging.debug('Setting default layout...')
-        dkl = "\t".join(dkl.split())
-        for i in LightDM.get_layouts():
-            if dkl == i.get_name():
-                m = "Set default keyboard layout to: '%s' %s"
-                logging.debug(m, i.get_name(), str(i))
-                session_settings['default_layout'] = i
-                LightDM.set_layout(session_settings['default_layout'])
-                break
+        i = layout_index.get("\t".join(dkl.split()))
+        if not i:
+            i = layout_index.get_by_description(dkl.strip())
+        if i:
+            m = "Set default keyboard layout to: '%s' %s"
+            logging.debug(m, i.get_name(), i)
+            session_settings['default_layout'] = i
+            layout_controller.set_layout(session_settings['default_layout'])
 
     keyboard_menubutton = builder.get_object('keyboard_menubutton')
     keyboard_menu = builder.get_object('keyboard_menu')
@@ -722,17 +1420,16 @@ def run():
                 'input-keyboard', Gtk.IconSize.MENU)
     image.show()
     keyboard_menubutton.add(image)
-    row = 0
-    for menu_item in generate_layout_menu_items(
-            session_settings['default_layout']):
-        keyboard_menu.attach(menu_item, 0, 1, row, row+1)
-        row += 1
+    # Only the default layout until the menu is populated
+    menu_item = new_layout_menu_item(session_settings['default_layout'], None)
+    keyboard_menu.attach(menu_item, 0, 1, 0, 1)
+    populate_menu_on_demand(keyboard_menu, populate_keyboard_menu)
     keyboard_menu.show_all()
     keyboard_menubutton.set_popup(keyboard_menu)
+    greeter_trace.end(trace_token)
 
-    # Login window: initilaise session menu
-    default_session = greeter_config.get(
-            'default-session', str(greeter.get_default_session_hint()))
+    # Login window: initilaise session menu. The menu is filled in once
+    # connected to the daemon as it provides the default session hint
     session_menubutton = builder.get_object('session_menubutton')
     session_menu = builder.get_object('session_menu')
 
@@ -741,31 +1438,7 @@ def run():
     session_menu_icon = session_menubutton.get_child()
     session_menu_icon.set_from_icon_name(
             session_menu_icon.get_icon_name().icon_name, Gtk.IconSize.MENU)
-
-    menu_item = Gtk.RadioMenuItem.new_with_label(None, 'Last used session')
-    menu_item.lightdm_session_key = SESSION_LAST_USED
-    menu_item.connect('activate', select_session_cb)
-    menu_item.join_group(None)
-    session_menu.attach(menu_item, 0, 1, 0, 1)
-    # Make sure first item is selected in case default-session is not properly
-    # defined in configuration
-    menu_item.activate()
-
-    last_item = menu_item
-    row = 1
-    for i in LightDM.get_sessions():
-        menu_item = Gtk.RadioMenuItem.new_with_label(None, i.get_name())
-        menu_item.lightdm_session_key = i.get_key()
-        menu_item.connect('activate', select_session_cb)
-        menu_item.join_group(last_item)
-        session_menu.attach(menu_item, 0, 1, row, row+1)
-        if default_session.lower() == i.get_key().lower():
-            menu_item.activate()
-            session_settings['default_session'] = i.get_key()
-        row += 1
-        last_item = menu_item
-    session_menu.show_all()
-    session_menubutton.set_popup(session_menu)
+    session_menubutton.set_sensitive(daemon_connected)
 
     # Login window: initilaise a11y menu
     a11y_menubutton = builder.get_object('a11y_menubutton')
@@ -804,6 +1477,7 @@ def run():
     message_box = builder.get_object('message_box')
     message_icon = builder.get_object('message_icon')
     message_text = builder.get_object('message_text')
+    message_spinner = builder.get_object('message_spinner')
 
     # Power window
     power_window = builder.get_object('power_window')
@@ -825,28 +1499,51 @@ def run():
             '<Login>/power/shutdown', Gdk.KEY_F4, Gdk.ModifierType.MOD1_MASK)
 
     # CSS
-    try:
-        css_provider = Gtk.CssProvider()
-        with open(CSS_APPLICATION_FILE, 'rb') as css_file:
-            css_provider.load_from_data(css_file.read())
-            Gtk.StyleContext.add_provider_for_screen(
-                    Gdk.Screen.get_default(),
-                    css_provider,
-                    Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
-    except FileNotFoundError as e:
-        m = "Could not load application css file '%s': %s"
-        logging.debug(m, e.filename, e.strerror)
-
-    background = greeter_background.GreeterSurface(
-            full_config, CONFIG_GROUP_DEFAULT, screen_overlay)
-    background.add_accel_group(builder.get_object('a11y_accel_group'))
-    background.add_accel_group(builder.get_object('power_accel_group'))
+    trace_token = greeter_trace.begin('CSS load')
+    css_provider = Gtk.CssProvider()
+    if use_resources:
+        css_provider.load_from_resource(CSS_APPLICATION_RESOURCE)
+        Gtk.StyleContext.add_provider_for_screen(
+                Gdk.Screen.get_default(),
+                css_provider,
+                Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+    else:
+        try:
+            with open(CSS_APPLICATION_FILE, 'rb') as css_file:
+                css_provider.load_from_data(css_file.read())
+                Gtk.StyleContext.add_provider_for_screen(
+                        Gdk.Screen.get_default(),
+                        css_provider,
+                        Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+        except FileNotFoundError as e:
+            m = "Could not load application css file '%s': %s"
+            logging.debug(m, e.filename, e.strerror)
+    greeter_trace.end(trace_token)
+
+    with greeter_trace.span('GreeterSurface'):
+        greeter_surface = greeter_background.GreeterSurface(
+                full_config, CONFIG_GROUP_DEFAULT, screen_overlay)
+    greeter_surface.add_accel_group(builder.get_object('a11y_accel_group'))
+    greeter_surface.add_accel_group(builder.get_object('power_accel_group'))
+
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, dump_state_cb)
+    # LightDM stops the greeter with SIGTERM. Leave the main loop so that the
+    # log writer thread is flushed on exit
+    GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM, terminate_cb)
     login_window.show_all()
     message_box.hide()
     screen_overlay.show()
+    screen_overlay.first_draw_trace = greeter_trace.begin('first draw')
+    screen_overlay.first_draw_handler = screen_overlay.connect_after(
+            'draw', first_draw_cb)
+
+    # The power capabilities are fetched once the bus is connected
+    Gio.bus_get(Gio.BusType.SYSTEM, None, system_bus_cb, None)
 
     username_entry.grab_focus()
     Gtk.main()
+    if not daemon_connected:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -19,16 +19,48 @@
 import gi
 gi.require_version('Gtk', '3.0')
 
-from gi.repository import GObject, Gtk, Gdk, GdkPixbuf
+from gi.repository import GLib, GObject, Gtk, Gdk, GdkPixbuf
+import cairo
 import os
+import hashlib
+import math
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from enum import Enum
 from typing import List
 import logging
 
+from lightdm_kbswitch_greeter import greeter_trace
+
 BACKGROUND_TYPE_SKIP = '#skip'
 CONFIG_MONITOR_PREFIX = 'monitor:'
 
+# Scaled backgrounds are stored on disk as the magic string followed by the
+# header (width, height, rowstride, has alpha, bits per sample, length of the
+# key, length of pixel data), the key and then the raw pixel data
+DISK_CACHE_MAGIC = b'KBSWPIX1'
+DISK_CACHE_HEADER = struct.Struct('=iiiiiII')
+DISK_CACHE_SUFFIX = '.pixbuf'
+# Cache files kept, least recently used are removed first. Each is a full
+# monitor's worth of uncompressed pixels, so only a few sets of monitor
+# geometries are kept
+DISK_CACHE_MAX_FILES = 8
+DEFAULT_CACHE_DIR = os.path.join(
+        GLib.get_user_cache_dir(), 'lightdm-kbswitch-greeter')
+# Colour shown while a background image is loaded in the background
+PLACEHOLDER_BACKGROUND = '#000000'
+# Bursts of monitors-changed signals within this many milliseconds of each
+# other only cause a single refresh
+MONITORS_CHANGED_DELAY = 250
+# Milliseconds the pointer has to stay on a monitor before the interface
+# follows it there
+POINTER_FOLLOW_DELAY = 150
+
 class ScalingMode(Enum):
     SOURCE = '#source'
     STRETCHED = '#stretched'
@@ -43,26 +75,267 @@ class MonitorError(Exception):
     pass
 
 
+class GreeterSurfaceError(Exception):
+    pass
+
+
 class PixbufCache:
-    def __init__(self):
-        self._cache = {}
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        """
+        Keyword arguments:
+        cache_dir -- directory in which scaled images are kept between runs
+                     of the greeter, or None to only cache in memory
+        max_bytes -- number of bytes of pixel data to keep in memory, or
+                     None for no limit. Images in use by a monitor are kept
+                     even if this is exceeded
+        """
+        self._cache = OrderedDict() # least recently used first
+        self._sources = set() # keys of unscaled images
+        self._users = {} # number of monitors and prefetches using each key
+        self._size = 0
+        self._max_bytes = max_bytes
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._executor = None
+        self._workers = 0
+        self._pending = {} # futures of images being loaded
+
+    @property
+    def size(self) -> int:
+        """Number of bytes of pixel data held"""
+        return self._size
+
+    @property
+    def pending(self) -> int:
+        """Number of images being loaded"""
+        with self._lock:
+            return len(self._pending)
+
+    @property
+    def stats(self) -> dict:
+        """Counters for sizing the memory budget"""
+        with self._lock:
+            return {
+                    'entries': len(self._cache),
+                    'bytes': self._size,
+                    'max_bytes': self._max_bytes,
+                    'hits': self._hits,
+                    'misses': self._misses,
+                    'evictions': self._evictions
+                    }
+
+    def entries(self) -> List[tuple]:
+        """(key, bytes, number of monitors using it) for each cached image"""
+        with self._lock:
+            return [(key, pixbuf.get_byte_length(), self._users.get(key, 0))
+                    for key, pixbuf in self._cache.items()]
 
     def get(self, image_path: str, mode: ScalingMode,
             width:int, height:int) -> GdkPixbuf.Pixbuf:
         """Return a GdkPixbuf.Pixbuf that has been zoomed, stretched or
         cropped to width and height
+
+        The image is counted as in use, and so is never evicted, until
+        release() is called with the same arguments.
         """
         key = ':'.join([image_path, mode.value, str(width), str(height)])
-        if key in self._cache.keys():
-            return self._cache[key]
-
+        with self._lock:
+            # Marked as in use before loading so that the image cannot be
+            # evicted before it is returned
+            self._users[key] = self._users.get(key, 0) + 1
+            scaled = self._cache.get(key, None)
+            if scaled:
+                self._hits += 1
+                self._cache.move_to_end(key)
+                return scaled
+
+        # Share the work with a load already in progress for another monitor
         try:
-            pixbuf = self._cache[image_path]
-        except KeyError:
+            return self._submit(image_path, mode, width, height).result()
+        except GLib.Error:
+            self.release(image_path, mode, width, height)
+            raise
+
+    def prefetch(self, images) -> List[tuple]:
+        """Load (image_path, mode, width, height) tuples in parallel and wait
+        for them to be ready for get()
+
+        GdkPixbuf releases the GIL while decoding and scaling so the time
+        taken is that of the slowest image rather than the sum of them. Errors
+        are not raised here but by the get() for the image.
+
+        The images are held as if in use, so that they are not evicted before
+        get() is called for them, until release() is called for each of the
+        images returned.
+        """
+        images = list(set(images))
+        with self._lock:
+            for image_path, mode, width, height in images:
+                key = ':'.join([image_path, mode.value, str(width),
+                        str(height)])
+                self._users[key] = self._users.get(key, 0) + 1
+            self._ensure_workers(len(images))
+        futures = [self._submit(*i) for i in images]
+        concurrent.futures.wait(futures)
+        return images
+
+    def _ensure_workers(self, jobs):
+        """Make sure the thread pool can run jobs at once, up to one per CPU.
+        Must be called with the lock held
+
+        The pool is kept no larger than the number of images being loaded
+        as under mlockall(MCL_FUTURE) each thread's stack stays locked in
+        memory.
+        """
+        workers = max(1, min(jobs, os.cpu_count() or 1))
+        if self._executor and self._workers >= workers: return
+        if self._executor:
+            # Jobs already queued on the old pool are still run
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._workers = workers
+
+    def _submit(self, image_path, mode, width, height):
+        """Return a Future for loading the image, starting a job in the
+        thread pool unless one is already running for the same image"""
+        key = ':'.join([image_path, mode.value, str(width), str(height)])
+        with self._lock:
+            future = self._pending.get(key, None)
+            if future: return future
+            self._ensure_workers(len(self._pending) + 1)
+            future = self._executor.submit(
+                    self._load, key, image_path, mode, width, height)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._job_done(key))
+        return future
+
+    def _job_done(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+            if not self._pending and self._executor:
+                # Let the threads, and their stacks, go until needed again
+                self._executor.shutdown(wait=False)
+                self._executor = None
+                self._workers = 0
+
+    def _load(self, key, image_path, mode, width, height):
+        """Add the scaled image to the cache and return it. Callers mark the
+        image as in use before submitting the job"""
+        with self._lock:
+            scaled = self._cache.get(key, None)
+            if scaled:
+                # Loaded since the job was submitted
+                self._hits += 1
+                return scaled
+            self._misses += 1
+
+        scaled = self._load_from_disk(image_path, mode, width, height)
+        if not scaled:
+            with self._lock:
+                pixbuf = self._cache.get(image_path, None)
+                if pixbuf:
+                    self._cache.move_to_end(image_path)
+            if pixbuf:
+                scaled = self._scale(pixbuf, mode, width, height)
+            else:
+                scaled = self._load_scaled(image_path, mode, width, height)
+            self._save_to_disk(scaled, image_path, mode, width, height)
+
+        with self._lock:
+            self._insert(key, scaled)
+            self._evict()
+        return scaled
+
+    def release(self, image_path: str, mode: ScalingMode,
+            width: int, height: int) -> None:
+        """Mark an image returned by get() as no longer in use"""
+        key = ':'.join([image_path, mode.value, str(width), str(height)])
+        with self._lock:
+            users = self._users.get(key, 0) - 1
+            if users > 0:
+                self._users[key] = users
+            else:
+                self._users.pop(key, None)
+            self._evict()
+
+    def _insert(self, key, pixbuf, source=False):
+        """Add pixbuf to the cache. Must be called with the lock held"""
+        if key in self._cache:
+            self._size -= self._cache[key].get_byte_length()
+        self._cache[key] = pixbuf
+        self._cache.move_to_end(key)
+        self._size += pixbuf.get_byte_length()
+        if source:
+            self._sources.add(key)
+
+    def _evict(self):
+        """Drop least recently used images that are not in use until the
+        cache fits in its budget. Unscaled images go first as they are only
+        needed to create new scaled images. Must be called with the lock
+        held"""
+        if self._max_bytes is None or self._size <= self._max_bytes: return
+        for sources_only in (True, False):
+            for key in list(self._cache.keys()):
+                if self._size <= self._max_bytes: return
+                if sources_only and key not in self._sources: continue
+                if key in self._users: continue
+                self._size -= self._cache.pop(key).get_byte_length()
+                self._sources.discard(key)
+                self._evictions += 1
+                logging.debug("Evicted '%s' from background cache", key)
+        logging.debug('Background cache uses %d bytes, over its budget of %d '
+                'bytes, as all images are in use', self._size, self._max_bytes)
+
+    def _load_scaled(self, image_path, mode, width, height):
+        """Decode image_path straight to the smallest size that still covers
+        width and height
+
+        Loaders such as the JPEG loader decode at a reduced size when asked
+        to, so large images never have to exist at full resolution. Only
+        images that have to be enlarged are decoded at full size and those
+        are kept in the cache as they are smaller than the monitor anyway.
+        """
+        _, p_width, p_height = GdkPixbuf.Pixbuf.get_file_info(image_path)
+        if not p_width or not p_height:
+            # Format could not be determined, let the loader report why.
             # Raises GLib.Error if fails
             pixbuf = GdkPixbuf.Pixbuf.new_from_file(image_path)
-            self._cache[image_path] = pixbuf
-
+            p_width = pixbuf.get_width()
+            p_height = pixbuf.get_height()
+        else:
+            pixbuf = None
+
+        scale_x = width / p_width
+        scale_y = height / p_height
+        if mode == ScalingMode.ZOOMED and max(scale_x, scale_y) < 1:
+            scale = max(scale_x, scale_y)
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(image_path,
+                    math.ceil(p_width * scale), math.ceil(p_height * scale),
+                    True)
+            return self._scale(pixbuf, mode, width, height)
+        elif mode == ScalingMode.STRETCHED and scale_x <= 1 and scale_y <= 1:
+            return GdkPixbuf.Pixbuf.new_from_file_at_scale(image_path,
+                    width, height, False)
+
+        if not pixbuf:
+            # Raises GLib.Error if fails
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(image_path)
+        if mode == ScalingMode.SOURCE:
+            if p_width <= width and p_height <= height:
+                return pixbuf
+            # Only the top left of the image is drawn so drop the rest
+            return pixbuf.new_subpixbuf(0, 0,
+                    min(p_width, width), min(p_height, height)).copy()
+
+        with self._lock:
+            self._insert(image_path, pixbuf, source=True)
+            self._evict()
+        return self._scale(pixbuf, mode, width, height)
+
+    def _scale(self, pixbuf, mode, width, height):
         if mode == ScalingMode.ZOOMED:
             offset_x = 0
             offset_y = 0
@@ -92,10 +365,148 @@ class PixbufCache:
                     GdkPixbuf.InterpType.BILINEAR)
         else:
             scaled = pixbuf
-        
-        self._cache[key] = scaled
         return scaled
 
+    def get_async(self, image_path: str, mode: ScalingMode,
+            width: int, height: int, callback, *user_data) -> None:
+        """Load the image as get() does but in a worker thread
+
+        callback is called from the main loop as
+        callback(pixbuf, error, *user_data) where error is the GLib.Error
+        raised while loading the image, in which case pixbuf is None
+        """
+        image = (image_path, mode, width, height)
+        key = ':'.join([image_path, mode.value, str(width), str(height)])
+        with self._lock:
+            self._users[key] = self._users.get(key, 0) + 1
+        future = self._submit(*image)
+        future.add_done_callback(
+                lambda f: GLib.idle_add(self._get_async_done_cb, f, image,
+                        callback, user_data))
+
+    def _get_async_done_cb(self, future, image, callback, user_data):
+        try:
+            pixbuf = future.result()
+        except GLib.Error as e:
+            self.release(*image)
+            callback(None, e, *user_data)
+            return False
+        callback(pixbuf, None, *user_data)
+        return False
+
+    def _disk_paths(self, image_path, mode, width, height):
+        """Return the path of the cache file for the arguments and the key
+        that identifies the source image version it was created from
+
+        The file name does not depend on the modification time or size of the
+        image so that a changed image overwrites its stale cache file rather
+        than leaving it behind.
+        """
+        stat = os.stat(image_path)
+        key = '\0'.join([os.path.abspath(image_path), str(stat.st_mtime_ns),
+                str(stat.st_size), mode.value, str(width), str(height)])
+        name_key = '\0'.join([os.path.abspath(image_path), mode.value,
+                str(width), str(height)])
+        name = hashlib.sha1(name_key.encode('utf-8')).hexdigest()
+        return os.path.join(self._cache_dir, name + DISK_CACHE_SUFFIX), key
+
+    def _load_from_disk(self, image_path, mode, width, height):
+        """Return the cached scaled pixbuf from the disk cache or None if
+        there is no valid cache file for the current version of the image"""
+        if not self._cache_dir: return None
+        try:
+            cache_path, key = self._disk_paths(
+                    image_path, mode, width, height)
+            with open(cache_path, 'rb') as f:
+                if f.read(len(DISK_CACHE_MAGIC)) != DISK_CACHE_MAGIC:
+                    return None
+                (p_width, p_height, rowstride, has_alpha, bits_per_sample,
+                        key_length, data_length) = DISK_CACHE_HEADER.unpack(
+                                f.read(DISK_CACHE_HEADER.size))
+                if f.read(key_length) != key.encode('utf-8'):
+                    return None
+                offset = f.tell()
+            # Map the file rather than reading it so the pixel data is paged
+            # in by the kernel and never copied
+            mapped = GLib.MappedFile.new(cache_path, False)
+            if mapped.get_length() != offset + data_length:
+                return None
+            if (p_width <= 0 or p_height <= 0 or
+                    rowstride * p_height > data_length):
+                return None
+            data = GLib.Bytes.new_from_bytes(
+                    mapped.get_bytes(), offset, data_length)
+            # Mark the file as recently used for _prune_disk_cache()
+            os.utime(cache_path)
+        except (OSError, ValueError, struct.error, GLib.Error):
+            # Missing, truncated or unreadable cache files are not fatal, the
+            # image is just decoded again
+            return None
+
+        logging.debug("Using cached background '%s' for '%s' (%s %dx%d)",
+                cache_path, image_path, mode.value, width, height)
+        return GdkPixbuf.Pixbuf.new_from_bytes(data, GdkPixbuf.Colorspace.RGB,
+                bool(has_alpha), bits_per_sample, p_width, p_height,
+                rowstride)
+
+    def _save_to_disk(self, pixbuf, image_path, mode, width, height):
+        if not self._cache_dir: return
+        try:
+            cache_path, key = self._disk_paths(
+                    image_path, mode, width, height)
+            key = key.encode('utf-8')
+            data = pixbuf.read_pixel_bytes().get_data()
+            # GdkPixbuf does not pad the last row, but it is stored padded
+            # so that the file can be checked to hold every row
+            padding = pixbuf.get_rowstride() * pixbuf.get_height() - len(data)
+            if padding > 0:
+                data += bytes(padding)
+            os.makedirs(self._cache_dir, mode=0o700, exist_ok=True)
+            # Write to a temporary file first so a partially written file is
+            # never picked up by another greeter instance
+            fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir)
+            written = False
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(DISK_CACHE_MAGIC)
+                    f.write(DISK_CACHE_HEADER.pack(pixbuf.get_width(),
+                            pixbuf.get_height(), pixbuf.get_rowstride(),
+                            int(pixbuf.get_has_alpha()),
+                            pixbuf.get_bits_per_sample(), len(key),
+                            len(data)))
+                    f.write(key)
+                    f.write(data)
+                os.replace(tmp_path, cache_path)
+                written = True
+            finally:
+                if not written:
+                    os.unlink(tmp_path)
+        except OSError as e:
+            logging.debug("Could not write background cache file for '%s': "
+                    "%s", image_path, e.strerror)
+            return
+        self._prune_disk_cache()
+
+    def _prune_disk_cache(self):
+        """Remove the least recently used cache files beyond
+        DISK_CACHE_MAX_FILES, e.g. those for geometries of monitors that are
+        no longer connected"""
+        try:
+            entries = [i for i in os.scandir(self._cache_dir)
+                    if i.name.endswith(DISK_CACHE_SUFFIX)]
+            entries.sort(key=lambda i: i.stat().st_mtime, reverse=True)
+        except OSError as e:
+            logging.debug('Could not list background cache: %s', e.strerror)
+            return
+        for entry in entries[DISK_CACHE_MAX_FILES:]:
+            try:
+                os.unlink(entry.path)
+                logging.debug("Removed background cache file '%s'",
+                        entry.path)
+            except OSError:
+                # Removed by another greeter instance
+                pass
+
 
 class BackgroundImageConfig:
     """Configuration to specify path and scaling for an image file to be used
@@ -166,15 +577,9 @@ class Monitor:
             raise MonitorError(m.format(number, self._screen.get_n_monitors()))
         self._number = number
         self._name = self._screen.get_monitor_plug_name(number)
-        
-        if self.name in greeter_surface.configs.keys():
-            self._config = greeter_surface.configs[self.name]
-        elif self.number in greeter_surface.configs.keys():
-            self._config = greeter_surface.configs[self.number]
-        else:
-            m = ('no configuration set for monitor %s, #%d. Using default')
-            logging.debug(m, self.printable_name, self.number)
-            self._config = greeter_surface.default_config
+        self._config = greeter_surface.get_monitor_config(self.name, number)
+        self._forced = False
+        self._cached_image = None
 
         self._geometry = self._screen.get_monitor_geometry(self.number)
         primary = ''
@@ -185,7 +590,9 @@ class Monitor:
                 self._geometry.width, self._geometry.height,
                 self._geometry.x, self._geometry.y, primary)
 
-        self._init_background(greeter_surface, pixbuf_cache)
+        with greeter_trace.span('Monitor._init_background',
+                monitor=self.printable_name):
+            self._init_background(greeter_surface, pixbuf_cache)
 
     @property
     def number(self):
@@ -209,6 +616,10 @@ class Monitor:
     def background(self):
         return self._background
 
+    @property
+    def geometry(self) -> Gdk.Rectangle:
+        return self._geometry
+
     def add_accel_group(self, accel_group):
         if self._window:
             self._window.add_accel_group(accel_group)
@@ -221,12 +632,42 @@ class Monitor:
             return True
         return False
         
-    def force_config(self, config, pixbuf_cache=None):
+    def matches(self, name, geometry, config) -> bool:
+        """True if the monitor can be kept as it is for an output with the
+        plug name, geometry and config given"""
+        return (not self._forced and
+                self.name == name and
+                self._config is config and
+                self._geometry.x == geometry.x and
+                self._geometry.y == geometry.y and
+                self._geometry.width == geometry.width and
+                self._geometry.height == geometry.height)
+
+    def renumber(self, number):
+        """Update the monitor number after other outputs were removed"""
+        if number != self._number:
+            logging.debug('Monitor %s #%d is now #%d',
+                    self.printable_name, self._number, number)
+            self._number = number
+
+    def force_config(self, config, greeter_surface, pixbuf_cache=None):
         """Override monitor config"""
         logging.debug('Explicitly set config for monitor %s #%d',
                 self.printable_name, self.number)
         self._config = config
-        self._init_background(pixbuf_cache)
+        self._forced = True
+        self._init_background(greeter_surface, pixbuf_cache)
+
+    def destroy(self, greeter_surface):
+        """Destroy the monitor's window, keeping the interface if it is shown
+        on this monitor"""
+        self._background_request = None
+        self._release_background()
+        if not self._window: return
+        if greeter_surface.child.get_property('parent') is self._window:
+            self._window.remove(greeter_surface.child)
+        self._window.destroy()
+        self._window = None
 
     def set_active(self, greeter_surface):
         """Move login interface to this monitor"""
@@ -234,6 +675,24 @@ class Monitor:
             m = 'Cannot set monitor {0} #{1} as active. No background present'
             raise MonitorError(m.format(self.printable_name, self.number))
 
+        interface_window = greeter_surface.interface_window
+        if interface_window:
+            # Move the window holding the interface instead of reparenting
+            # the interface, which would have to be allocated again
+            if greeter_surface.active_monitor is not self:
+                logging.debug('Moving interface to monitor %s #%d',
+                        self.printable_name, self.number)
+                interface_window.set_size_request(
+                        self._geometry.width, self._geometry.height)
+                interface_window.resize(
+                        self._geometry.width, self._geometry.height)
+                interface_window.move(self._geometry.x, self._geometry.y)
+                interface_window.present()
+                # The window shows this monitor's background
+                interface_window.queue_draw()
+            greeter_surface.set_active_monitor(self)
+            return
+
         # old_parent may be None or Gtk.Window
         old_parent = greeter_surface.child.get_property('parent')
         if self._window is not old_parent:
@@ -252,25 +711,90 @@ class Monitor:
                 focus_widget.grab_focus()
                 if editable_pos > -1:
                     focus_widget.set_position(editable_pos)
+        greeter_surface.set_active_monitor(self)
 
     def enter_notify_event_cb(self, window, event, greeter_surface):
-        self.set_active(greeter_surface)
+        # Crossings to and from the interface within the window do not count
+        if event.detail != Gdk.NotifyType.INFERIOR:
+            greeter_surface.follow_pointer(self)
         return False
 
+    def leave_notify_event_cb(self, window, event, greeter_surface):
+        if event.detail != Gdk.NotifyType.INFERIOR:
+            greeter_surface.cancel_follow_pointer(self)
+        return False
+
+    def background_loaded_cb(self, pixbuf, error, request, greeter_surface):
+        if request is not self._background_request:
+            # Monitor has been reinitialised since the image was requested
+            if pixbuf:
+                pixbuf_cache, image = request
+                pixbuf_cache.release(*image)
+            return
+        self._background_request = None
+        if error:
+            logging.debug("Could not load background for monitor %s #%d: %s",
+                    self.printable_name, self.number, error.message)
+            return
+        self._cached_image = request
+        logging.debug('Background loaded for monitor %s #%d',
+                self.printable_name, self.number)
+        self._background = pixbuf
+        self._update_background_surface()
+        if self._window:
+            self._window.queue_draw()
+        if (greeter_surface.interface_window and
+                greeter_surface.active_monitor is self):
+            greeter_surface.interface_window.queue_draw()
+
     def draw_monitor_background_cb(self, widget, cr):
         if not self._background: return
+        # Only paint the area that needs redrawing
+        x1, y1, x2, y2 = cr.clip_extents()
+        cr.rectangle(x1, y1, x2 - x1, y2 - y1)
         if isinstance(self._background, Gdk.RGBA):
-            cr.rectangle(0, 0, self._geometry.width, self._geometry.height)
-            Gdk.cairo_set_source_rgba(cr, self._config.background)
-            cr.fill()
-        elif isinstance(self._background, GdkPixbuf.Pixbuf):
+            Gdk.cairo_set_source_rgba(cr, self._background)
+        elif self._surface:
+            cr.set_source_surface(self._surface, 0, 0)
+        else:
             Gdk.cairo_set_source_pixbuf(cr, self._background, 0, 0)
-            cr.paint()
+        cr.fill()
         return False
 
+    def _update_background_surface(self):
+        """Copy the background pixbuf into a surface held by the X server
+        once so that it does not need to be converted and sent to the server
+        every time the window is drawn"""
+        self._surface = None
+        if not isinstance(self._background, GdkPixbuf.Pixbuf): return
+        if not self._window: return
+        gdk_window = self._window.get_window()
+        if not gdk_window: return
+        if self._background.get_has_alpha():
+            content = cairo.CONTENT_COLOR_ALPHA
+        else:
+            content = cairo.CONTENT_COLOR
+        # Unlike Gdk.cairo_surface_create_from_pixbuf(), which gives an image
+        # surface in the greeter's memory, this is an X pixmap
+        self._surface = gdk_window.create_similar_surface(content,
+                self._background.get_width(), self._background.get_height())
+        cr = cairo.Context(self._surface)
+        Gdk.cairo_set_source_pixbuf(cr, self._background, 0, 0)
+        cr.paint()
+
+    def _release_background(self):
+        """Let the PixbufCache evict the image this monitor was using"""
+        if self._cached_image:
+            pixbuf_cache, image = self._cached_image
+            pixbuf_cache.release(*image)
+            self._cached_image = None
+
     def _init_background(self, greeter_surface, pixbuf_cache=None):
+        self._release_background()
         self._window = None
         self._background = None
+        self._background_request = None
+        self._surface = None
         if not self._config.background: return
 
         bg = self._config.background
@@ -279,8 +803,19 @@ class Monitor:
         elif isinstance(bg, BackgroundImageConfig):
             if not pixbuf_cache:
                 pixbuf_cache = PixbufCache()
-            self._background = pixbuf_cache.get(bg.path, bg.scaling_mode,
+            image = (bg.path, bg.scaling_mode,
                     self._geometry.width, self._geometry.height)
+            if greeter_surface.async_backgrounds:
+                # Show a flat colour until the image has been decoded so that
+                # the interface can be used straight away
+                self._background = Gdk.RGBA()
+                self._background.parse(PLACEHOLDER_BACKGROUND)
+                self._background_request = (pixbuf_cache, image)
+                pixbuf_cache.get_async(*image, self.background_loaded_cb,
+                        self._background_request, greeter_surface)
+            else:
+                self._background = pixbuf_cache.get(*image)
+                self._cached_image = (pixbuf_cache, image)
         else:
             m = "Invalid background set in config: '{0}'"
             raise MonitorError(m.format(str(self._config.background)))
@@ -295,9 +830,12 @@ class Monitor:
                 self._geometry.width, self._geometry.height)
         self._window.move(self._geometry.x, self._geometry.y)
         self._window.show()
+        self._update_background_surface()
         self._window.connect('draw', self.draw_monitor_background_cb)
         self._window.connect('enter-notify-event', self.enter_notify_event_cb,
                 greeter_surface)
+        self._window.connect('leave-notify-event', self.leave_notify_event_cb,
+                greeter_surface)
 
         if self.name:
             self._window.set_name('monitor-{0}'.format(self.name))
@@ -325,6 +863,27 @@ class GreeterSurface(GObject.GObject):
         self._accel_groups = set()
 
         self._default_config = MonitorConfig(config[default_config_section])
+        # An empty value disables the on-disk cache
+        self._cache_dir = config[default_config_section].get(
+                'background-cache-dir', DEFAULT_CACHE_DIR) or None
+        self._async_backgrounds = config[default_config_section].getboolean(
+                'background-async', False)
+        max_bytes = config[default_config_section].getint(
+                'background-cache-max-mb', None)
+        if max_bytes is not None:
+            max_bytes = max_bytes * 1024 * 1024
+        self._pixbuf_cache = PixbufCache(self._cache_dir, max_bytes)
+        self._monitors = [] # all monitors
+        self._enabled_monitors = [] # monitors we can draw on
+        self._refresh_source = None
+        self._active_monitor = None
+        self._follow_delay = config[default_config_section].getint(
+                'pointer-follow-delay', POINTER_FOLLOW_DELAY)
+        self._follow_monitor = None
+        self._follow_source = None
+        self._moves = 0
+        self._relayouts = 0
+        self._child.connect('size-allocate', self.child_size_allocate_cb)
 
         self._configs = {}
         for section in config.sections():
@@ -335,8 +894,12 @@ class GreeterSurface(GObject.GObject):
         self._screen = Gdk.Screen.get_default()
         logging.debug(
                 'Connecting to screen %s (%dx%dpx, %dx%dmm)',
-                str(self._screen), self._screen.width(), self._screen.height(),
+                self._screen, self._screen.width(), self._screen.height(),
                 self._screen.width_mm(), self._screen.height_mm())
+        self._interface_window = None
+        if config[default_config_section].getboolean(
+                'single-interface-window', False):
+            self._interface_window = self._create_interface_window()
         self._refresh_monitors()
         self._screen.connect('monitors-changed', self.monitors_changed_cb)
 
@@ -364,10 +927,50 @@ class GreeterSurface(GObject.GObject):
 
         return focus_widget, editable_pos
 
+    @property
+    def monitors(self) -> List[Monitor]:
+        """All monitors, including skipped ones"""
+        return self._monitors
+
+    @property
+    def pixbuf_cache(self) -> PixbufCache:
+        return self._pixbuf_cache
+
+    @property
+    def async_backgrounds(self) -> bool:
+        """True if background images are loaded without blocking"""
+        return self._async_backgrounds
+
     @property
     def accel_groups(self):
         return self._accel_groups
 
+    @property
+    def interface_window(self) -> Gtk.Window:
+        """Window that is moved between monitors to show the interface, or
+        None if the interface is reparented into the monitors' windows"""
+        return self._interface_window
+
+    @property
+    def active_monitor(self) -> Monitor:
+        """Monitor the interface is shown on"""
+        return self._active_monitor
+
+    @property
+    def pending_sources(self) -> int:
+        """Number of main loop sources waiting to refresh the monitors or
+        follow the pointer"""
+        return ((1 if self._refresh_source else 0) +
+                (1 if self._follow_source else 0))
+
+    @property
+    def stats(self) -> dict:
+        """Number of times the interface moved monitor and was allocated"""
+        return {
+                'moves': self._moves,
+                'relayouts': self._relayouts
+                }
+
     @property
     def default_config(self) -> MonitorConfig:
         return self._default_config
@@ -376,6 +979,62 @@ class GreeterSurface(GObject.GObject):
     def configs(self) -> List[MonitorConfig]:
         return self._configs
 
+    def get_monitor_config(self, name, number) -> MonitorConfig:
+        """Return the configuration for the monitor with the plug name or
+        number given"""
+        if name in self._configs.keys():
+            return self._configs[name]
+        elif number in self._configs.keys():
+            return self._configs[number]
+        m = ('no configuration set for monitor %s, #%d. Using default')
+        logging.debug(m, name or '<unknown>', number)
+        return self._default_config
+
+    def set_active_monitor(self, monitor: Monitor) -> None:
+        """Record that monitor is showing the interface"""
+        if monitor is not self._active_monitor:
+            self._active_monitor = monitor
+            self._moves += 1
+
+    def follow_pointer(self, monitor: Monitor) -> None:
+        """Move the interface to monitor once the pointer has stayed on it
+        for the follow delay"""
+        if self._follow_source:
+            GLib.source_remove(self._follow_source)
+            self._follow_source = None
+        self._follow_monitor = None
+        if monitor is self._active_monitor: return
+        if self._follow_delay <= 0:
+            monitor.set_active(self)
+            return
+        self._follow_monitor = monitor
+        self._follow_source = GLib.timeout_add(
+                self._follow_delay, self.follow_pointer_timeout_cb)
+
+    def cancel_follow_pointer(self, monitor: Monitor = None) -> None:
+        """Stop the interface from following the pointer to monitor, or to
+        any monitor if None"""
+        if monitor and monitor is not self._follow_monitor: return
+        if self._follow_source:
+            GLib.source_remove(self._follow_source)
+            self._follow_source = None
+        self._follow_monitor = None
+
+    def follow_pointer_timeout_cb(self):
+        self._follow_source = None
+        monitor = self._follow_monitor
+        self._follow_monitor = None
+        monitor.set_active(self)
+        return False
+
+    def child_size_allocate_cb(self, widget, allocation):
+        self._relayouts += 1
+
+    def draw_interface_background_cb(self, widget, cr):
+        if self._active_monitor:
+            return self._active_monitor.draw_monitor_background_cb(widget, cr)
+        return False
+
     def child_destroyed_cb(self, child_widget):
         self._child = None
     
@@ -386,30 +1045,73 @@ class GreeterSurface(GObject.GObject):
             raise GreeterSurfaceError(m.format(screen, self), screen)
         logging.debug(
                 'Monitors changed for screen %s',
-                str(self._screen))
+                self._screen)
+        # Docking stations and KVM switches send several signals in a row so
+        # wait for them to settle before refreshing
+        if self._refresh_source:
+            GLib.source_remove(self._refresh_source)
+        self._refresh_source = GLib.timeout_add(
+                MONITORS_CHANGED_DELAY, self.refresh_monitors_timeout_cb)
+
+    def refresh_monitors_timeout_cb(self):
+        self._refresh_source = None
         self._refresh_monitors()
+        return False
 
     def add_accel_group(self, accel_group):
         if accel_group not in self._accel_groups:
             self._accel_groups.add(accel_group)
             for i in self._enabled_monitors:
                 i.add_accel_group(accel_group)
+            if self._interface_window:
+                self._interface_window.add_accel_group(accel_group)
+
+    def _create_interface_window(self) -> Gtk.Window:
+        window = Gtk.Window(Gtk.WindowType.TOPLEVEL)
+        window.set_decorated(False)
+        window.set_resizable(False)
+        window.set_app_paintable(True)
+        window.set_screen(self._screen)
+        window.set_name('interface')
+        window.connect('draw', self.draw_interface_background_cb)
+        window.add(self._child)
+        return window
 
     def _refresh_monitors(self):
         logging.debug(
                 'Setting monitor backgrounds for screen %s',
-                str(self._screen))
+                self._screen)
 
+        # The monitor the pointer is heading for may be about to go
+        self.cancel_follow_pointer()
+        old_monitors = self._monitors
         self._monitors = [] # all monitors
         self._enabled_monitors = [] # monitors we can draw on
         first_not_skipped_monitor = None
-        pixbuf_cache = PixbufCache()
 
         num_monitors = self._screen.get_n_monitors()
         logging.debug('Monitors found: %d', num_monitors)
 
+        prefetched = []
+        if not self._async_backgrounds:
+            prefetched = self._prefetch_backgrounds(old_monitors, num_monitors)
+
         for i in range(0, num_monitors):
-            monitor = Monitor(i, self, pixbuf_cache)
+            # Keep monitors that have not changed rather than recreating their
+            # windows and backgrounds
+            name = self._screen.get_monitor_plug_name(i)
+            geometry = self._screen.get_monitor_geometry(i)
+            config = self.get_monitor_config(name, i)
+            for monitor in old_monitors:
+                if monitor.matches(name, geometry, config):
+                    old_monitors.remove(monitor)
+                    monitor.renumber(i)
+                    logging.debug('Monitor %s #%d is unchanged',
+                            monitor.printable_name, monitor.number)
+                    break
+            else:
+                monitor = Monitor(i, self, self._pixbuf_cache)
+
             self._monitors.append(monitor)
             if not monitor.is_enabled:
                 # No background implying skip this monitor
@@ -423,11 +1125,13 @@ class GreeterSurface(GObject.GObject):
                 logging.debug(m, monitor.printable_name, monitor.number)
 
                 if self.default_config.background:
-                    monitor.force_config(self.default_config)
+                    monitor.force_config(self.default_config, self,
+                            self._pixbuf_cache)
                 else:
                     # default_config has skip background type so force
                     # config that will render
-                    monitor.force_config(MonitorConfig())
+                    monitor.force_config(MonitorConfig(), self,
+                            self._pixbuf_cache)
 
             logging.debug('Monitor %s #%d is enabled',
                     monitor.printable_name, monitor.number)
@@ -435,6 +1139,20 @@ class GreeterSurface(GObject.GObject):
             if not first_not_skipped_monitor:
                 first_not_skipped_monitor = monitor
 
+        for monitor in old_monitors:
+            logging.debug('Removing monitor %s', monitor.printable_name)
+            monitor.destroy(self)
+        for image in prefetched:
+            self._pixbuf_cache.release(*image)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug('Background cache: %s', self._pixbuf_cache.stats)
+
+        if self._active_monitor in self._enabled_monitors:
+            logging.debug('Interface stays on monitor %s #%d',
+                    self._active_monitor.printable_name,
+                    self._active_monitor.number)
+            return
+
         x, y = self._get_cursor_position()
         for monitor in self._enabled_monitors:
             if monitor.contains_coordinate(x, y):
@@ -450,6 +1168,26 @@ class GreeterSurface(GObject.GObject):
                     first_not_skipped_monitor.number)
             first_not_skipped_monitor.set_active(self)
 
+    def _prefetch_backgrounds(self, old_monitors, num_monitors):
+        """Scale the background images for new monitors in parallel. The
+        images returned must be released once the monitors have been
+        created"""
+        images = []
+        for i in range(0, num_monitors):
+            name = self._screen.get_monitor_plug_name(i)
+            geometry = self._screen.get_monitor_geometry(i)
+            config = self.get_monitor_config(name, i)
+            if not isinstance(config.background, BackgroundImageConfig):
+                continue
+            if any(m.matches(name, geometry, config) for m in old_monitors):
+                continue
+            images.append((config.background.path,
+                    config.background.scaling_mode,
+                    geometry.width, geometry.height))
+        if not images: return []
+        with greeter_trace.span('PixbufCache.prefetch', images=len(images)):
+            return self._pixbuf_cache.prefetch(images)
+
     def _get_cursor_position(self):
         display = self.screen.get_display()
         device = display.get_device_manager().get_client_pointer()
@@ -0,0 +1,177 @@
+# lightdm-kbswitch-greeter A Gtk3 based greeter for LightDM
+# Copyright (C) 2016 Andrew Bates
+# Author Andrew Bates <andrew.bates@cantab.net>
+# Based on lightdm-gtk-greeter Copyright (C) 2010-2011 Robert Ancell
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gi
+gi.require_version('LightDM', '1')
+
+from gi.repository import GLib, LightDM
+from typing import Iterable, List, Optional
+import logging
+import time
+
+
+def get_layout_region(layout: LightDM.Layout) -> str:
+    return layout.get_name().split()[0]
+
+
+class LayoutIndex:
+    """Keyboard layouts looked up by name, region and display description
+
+    LightDM.get_layouts() walks the whole XKB catalogue each time it is
+    called, so it is called once and the index shared by everything that
+    needs to find a layout. The index by description is only built the
+    first time it is used as it needs every layout's description.
+    """
+    def __init__(self, layouts: Iterable[LightDM.Layout] = None) -> None:
+        if layouts is None:
+            layouts = LightDM.get_layouts()
+        self._by_name = {}
+        self._by_region = {}
+        self._by_description = None
+        self._descriptions = {}
+        for layout in layouts:
+            self._by_name[layout.get_name()] = layout
+            region = get_layout_region(layout)
+            if region not in self._by_region:
+                self._by_region[region] = []
+            self._by_region[region].append(layout)
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def get(self, name: str) -> Optional[LightDM.Layout]:
+        """Layout with the name given, e.g. 'gb\tdvorak', or None"""
+        return self._by_name.get(name, None)
+
+    def get_region(self, region: str) -> List[LightDM.Layout]:
+        """All layouts in region, e.g. 'gb'"""
+        return self._by_region.get(region, [])
+
+    def get_by_description(self, description: str
+            ) -> Optional[LightDM.Layout]:
+        """Layout shown in the keyboard menu as description, or None"""
+        if self._by_description is None:
+            self._by_description = {}
+            for layout in self._by_name.values():
+                self._by_description.setdefault(
+                        self.get_description(layout), layout)
+        return self._by_description.get(description, None)
+
+    def get_description(self, layout: LightDM.Layout) -> str:
+        """Description of layout as shown in the keyboard menu"""
+        name = layout.get_name()
+        try:
+            return self._descriptions[name]
+        except KeyError:
+            pass
+
+        l_desc = layout.get_description()
+        if get_layout_region(layout) == name:
+            # Switch countries and languages where language is written first
+            pos = l_desc.find(' (')
+            if pos != -1:
+                l_desc = '{0} ({1})'.format(l_desc[pos+2:-1], l_desc[:pos])
+        self._descriptions[name] = l_desc
+        return l_desc
+
+
+class LayoutController:
+    """Applies keyboard layout changes
+
+    Each LightDM.set_layout() is a round trip to the X server, which is slow
+    on remote displays. Changes to the layout that is already set are
+    skipped and changes made in the same main loop iteration, e.g. while
+    menus are built or reset, are merged into a single switch.
+    """
+    def __init__(self, current: LightDM.Layout) -> None:
+        """
+        Keyword arguments:
+        current -- layout currently set on the X server
+        """
+        self._current = current
+        self._pending = None
+        self._source = None
+        self._switches = 0
+        self._skipped = 0
+        self._switch_time = 0.0
+
+    @property
+    def layout(self) -> LightDM.Layout:
+        """Most recently requested layout"""
+        if self._pending:
+            return self._pending
+        return self._current
+
+    @property
+    def pending_sources(self) -> int:
+        """Number of main loop sources waiting to switch layout"""
+        return 1 if self._source else 0
+
+    @property
+    def stats(self) -> dict:
+        """Number of switches made and skipped and the time spent switching
+        in seconds"""
+        return {
+                'switches': self._switches,
+                'skipped': self._skipped,
+                'switch_time': self._switch_time
+                }
+
+    def set_layout(self, layout: LightDM.Layout) -> None:
+        """Switch to layout once the main loop is idle"""
+        if layout.get_name() == self.layout.get_name():
+            self._skipped += 1
+            return
+
+        if layout.get_name() == self._current.get_name():
+            # Switching back before the pending switch was made
+            self._skipped += 1
+            self._pending = None
+            GLib.source_remove(self._source)
+            self._source = None
+            return
+
+        if self._pending:
+            self._skipped += 1
+        self._pending = layout
+        if not self._source:
+            self._source = GLib.idle_add(self.apply_layout_cb)
+
+    def flush(self) -> None:
+        """Make any pending switch straight away"""
+        if self._source:
+            GLib.source_remove(self._source)
+            self.apply_layout_cb()
+
+    def apply_layout_cb(self):
+        self._source = None
+        layout = self._pending
+        self._pending = None
+        if not layout: return False
+
+        start = time.monotonic()
+        LightDM.set_layout(layout)
+        elapsed = time.monotonic() - start
+        self._current = layout
+        self._switches += 1
+        self._switch_time += elapsed
+        logging.debug("Switched keyboard layout to '%s' in %.1fms (%d "
+                "switches taking %.1fms, %d skipped)", layout.get_name(),
+                elapsed * 1000, self._switches, self._switch_time * 1000,
+                self._skipped)
+        return False
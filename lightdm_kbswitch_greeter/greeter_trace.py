@@ -0,0 +1,99 @@
+# lightdm-kbswitch-greeter A Gtk3 based greeter for LightDM
+# Copyright (C) 2016 Andrew Bates
+# Author Andrew Bates <andrew.bates@cantab.net>
+# Based on lightdm-gtk-greeter Copyright (C) 2010-2011 Robert Ancell
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Timing of named spans during startup, written out as a Chrome trace
+
+Spans are recorded from import until finish() is called, normally once
+the login window has first been drawn. If a trace file has been set with
+set_trace_file() or the LIGHTDM_KBSWITCH_GREETER_TRACE environment variable
+the spans are then written to it in the Chrome trace event format, which
+can be loaded into chrome://tracing or Perfetto.
+"""
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+import time
+
+TRACE_FILE_ENVIRONMENT_VARIABLE = 'LIGHTDM_KBSWITCH_GREETER_TRACE'
+
+_lock = threading.Lock()
+_events = []
+_recording = True
+_trace_file = os.environ.get(TRACE_FILE_ENVIRONMENT_VARIABLE, None)
+
+
+def set_trace_file(path: str) -> None:
+    """Write the trace to path, unless the environment variable is set"""
+    global _trace_file
+    if not os.environ.get(TRACE_FILE_ENVIRONMENT_VARIABLE, None):
+        _trace_file = path
+
+
+def begin(name: str, **args):
+    """Start a span that is ended by passing the return value to end()"""
+    return (name, time.perf_counter(), threading.get_ident(), args)
+
+
+def end(token) -> None:
+    name, start, thread, args = token
+    if not _recording: return
+    event = {
+            'name': name,
+            'cat': 'startup',
+            'ph': 'X',
+            'ts': start * 1000000,
+            'dur': (time.perf_counter() - start) * 1000000,
+            'pid': os.getpid(),
+            'tid': thread
+            }
+    if args:
+        event['args'] = args
+    with _lock:
+        _events.append(event)
+
+
+@contextmanager
+def span(name: str, **args):
+    """Record the time taken by the body of a with statement"""
+    token = begin(name, **args)
+    try:
+        yield
+    finally:
+        end(token)
+
+
+def finish() -> None:
+    """Stop recording and write the trace file if one has been set"""
+    global _recording
+    if not _recording: return
+    _recording = False
+    if not _trace_file: return
+    with _lock:
+        trace = {'traceEvents': _events, 'displayTimeUnit': 'ms'}
+        try:
+            with open(_trace_file, 'w', encoding='utf-8') as f:
+                json.dump(trace, f)
+        except OSError as e:
+            logging.debug("Could not write trace file '%s': %s",
+                    _trace_file, e.strerror)
+            return
+    logging.debug("Wrote %d startup trace events to '%s'",
+            len(_events), _trace_file)
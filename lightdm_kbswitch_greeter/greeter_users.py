@@ -0,0 +1,205 @@
+# lightdm-kbswitch-greeter A Gtk3 based greeter for LightDM
+# Copyright (C) 2016 Andrew Bates
+# Author Andrew Bates <andrew.bates@cantab.net>
+# Based on lightdm-gtk-greeter Copyright (C) 2010-2011 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gi
+gi.require_version('LightDM', '1')
+
+from gi.repository import Gio, GLib, LightDM
+from typing import List, Optional
+import bisect
+import logging
+
+ACCOUNTS_BUS_NAME       = 'org.freedesktop.Accounts'
+ACCOUNTS_OBJECT_PATH    = '/org/freedesktop/Accounts'
+ACCOUNTS_INTERFACE      = 'org.freedesktop.Accounts'
+ACCOUNTS_USER_INTERFACE = 'org.freedesktop.Accounts.User'
+PROPERTIES_INTERFACE    = 'org.freedesktop.DBus.Properties'
+# Calls to AccountsService in flight at once while the cache is filled, so
+# that a large directory does not queue thousands of messages in one go
+ACCOUNTS_MAX_CALLS      = 32
+
+
+class AccountsCache:
+    """User names and last sessions read from AccountsService without
+    blocking the main loop
+
+    Nothing is known until load() has been called and the replies have come
+    in, which happens a few users at a time between other events. The cache
+    is then kept up to date from AccountsService's signals. User names are
+    kept in a sorted list so names starting with a prefix can be found by
+    bisection.
+    """
+    def __init__(self) -> None:
+        self._connection = None
+        self._sessions = {} # session by user name
+        self._names = [] # sorted user names
+        self._paths = {} # user name by object path
+        self._queue = [] # object paths of users to read
+        self._calls = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def load(self) -> None:
+        """Start reading every user from AccountsService"""
+        Gio.bus_get(Gio.BusType.SYSTEM, None, self.bus_cb, None)
+
+    def get_session(self, name: str) -> Optional[str]:
+        """Last session of the user called name, or None if not known"""
+        return self._sessions.get(name, None)
+
+    def complete(self, prefix: str, limit: int) -> List[str]:
+        """Up to limit user names starting with prefix, in order"""
+        if not prefix: return []
+        start = bisect.bisect_left(self._names, prefix)
+        matches = []
+        for name in self._names[start:start + limit]:
+            if not name.startswith(prefix): break
+            matches.append(name)
+        return matches
+
+    def bus_cb(self, source, result, user_data):
+        try:
+            self._connection = Gio.bus_get_finish(result)
+        except GLib.Error as e:
+            logging.debug('Could not connect to system bus: %s', e.message)
+            return
+        for interface, signal, callback in (
+                (ACCOUNTS_INTERFACE, 'UserAdded', self.user_added_cb),
+                (ACCOUNTS_INTERFACE, 'UserDeleted', self.user_deleted_cb),
+                (ACCOUNTS_USER_INTERFACE, 'Changed', self.user_changed_cb)):
+            self._connection.signal_subscribe(ACCOUNTS_BUS_NAME, interface,
+                    signal, None, None, Gio.DBusSignalFlags.NONE, callback,
+                    None)
+        self._connection.call(ACCOUNTS_BUS_NAME, ACCOUNTS_OBJECT_PATH,
+                ACCOUNTS_INTERFACE, 'ListCachedUsers', None,
+                GLib.VariantType.new('(ao)'), Gio.DBusCallFlags.NONE, -1,
+                None, self.list_users_cb, None)
+
+    def list_users_cb(self, connection, result, user_data):
+        try:
+            paths = connection.call_finish(result).unpack()[0]
+        except GLib.Error as e:
+            logging.debug('Could not list users: %s', e.message)
+            return
+        logging.debug('Reading %d users from AccountsService', len(paths))
+        self._queue.extend(paths)
+        self._read_users()
+
+    def _read_users(self):
+        while self._queue and self._calls < ACCOUNTS_MAX_CALLS:
+            path = self._queue.pop()
+            self._calls += 1
+            self._connection.call(ACCOUNTS_BUS_NAME, path,
+                    PROPERTIES_INTERFACE, 'GetAll',
+                    GLib.Variant('(s)', (ACCOUNTS_USER_INTERFACE,)),
+                    GLib.VariantType.new('(a{sv})'), Gio.DBusCallFlags.NONE,
+                    -1, None, self.read_user_cb, path)
+
+    def read_user_cb(self, connection, result, path):
+        self._calls -= 1
+        try:
+            properties = connection.call_finish(result).unpack()[0]
+        except GLib.Error as e:
+            logging.debug("Could not read user '%s': %s", path, e.message)
+            properties = None
+        if properties and properties.get('UserName', None):
+            self._remove(path)
+            name = properties['UserName']
+            if name not in self._sessions:
+                bisect.insort(self._names, name)
+            self._sessions[name] = properties.get('XSession', None) or None
+            self._paths[path] = name
+        self._read_users()
+        if not self._queue and not self._calls:
+            logging.debug('AccountsService user cache holds %d users',
+                    len(self._sessions))
+
+    def _remove(self, path):
+        name = self._paths.pop(path, None)
+        if name is None: return
+        del self._sessions[name]
+        del self._names[bisect.bisect_left(self._names, name)]
+
+    def user_added_cb(self, connection, sender, path, interface, signal,
+            parameters, user_data):
+        self._queue.append(parameters.unpack()[0])
+        self._read_users()
+
+    def user_deleted_cb(self, connection, sender, path, interface, signal,
+            parameters, user_data):
+        self._remove(parameters.unpack()[0])
+
+    def user_changed_cb(self, connection, sender, path, interface, signal,
+            parameters, user_data):
+        if path in self._paths:
+            self._queue.append(path)
+            self._read_users()
+
+
+class UserDirectory:
+    """Users known to LightDM, kept up to date from the user list's signals
+
+    Walking LightDM.UserList.get_users() is slow when AccountsService knows
+    about thousands of users, so the list is walked once and everything
+    that is needed afterwards is maintained as users are added, changed and
+    removed.
+    """
+    def __init__(self, user_list: LightDM.UserList = None) -> None:
+        if user_list is None:
+            user_list = LightDM.UserList.get_instance()
+        self._user_list = user_list
+        self._logged_in = {}
+        self._logged_in_count = 0
+        for user in user_list.get_users():
+            self._add(user)
+        user_list.connect('user-added', self.user_added_cb)
+        user_list.connect('user-changed', self.user_changed_cb)
+        user_list.connect('user-removed', self.user_removed_cb)
+        logging.debug('User directory has %d users, %d logged in',
+                len(self._logged_in), self._logged_in_count)
+
+    def __len__(self) -> int:
+        return len(self._logged_in)
+
+    @property
+    def logged_in_count(self) -> int:
+        """Number of users with a session open"""
+        return self._logged_in_count
+
+    def _add(self, user: LightDM.User) -> None:
+        logged_in = user.get_logged_in()
+        self._logged_in[user.get_name()] = logged_in
+        if logged_in:
+            self._logged_in_count += 1
+
+    def _remove(self, name: str) -> None:
+        if self._logged_in.pop(name):
+            self._logged_in_count -= 1
+
+    def user_added_cb(self, user_list, user):
+        if user.get_name() in self._logged_in:
+            self._remove(user.get_name())
+        self._add(user)
+
+    def user_changed_cb(self, user_list, user):
+        self.user_added_cb(user_list, user)
+
+    def user_removed_cb(self, user_list, user):
+        if user.get_name() in self._logged_in:
+            self._remove(user.get_name())
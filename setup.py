@@ -1,4 +1,6 @@
 from DistUtilsExtra.auto import setup
+from DistUtilsExtra.command.build_extra import build_extra
+from distutils.cmd import Command
 from os import path
 
 def find_var(var_name, *path_parts, **kwargs):
@@ -25,6 +27,35 @@ with open(path.join(here, 'README.rst'), encoding='utf-8') as f:
 # set the text domain for gettext
 name = find_var('APP_NAME', here, PACKAGE_NAME, 'greeter.py')
 
+
+class build_gresource(Command):
+    """Compile the interface, CSS and icons into a single GResource bundle
+    that the greeter memory-maps at startup"""
+    description = 'compile data files into a GResource bundle'
+    user_options = []
+
+    def initialize_options(self):
+        self.build_base = None
+
+    def finalize_options(self):
+        self.set_undefined_options('build', ('build_base', 'build_base'))
+
+    def run(self):
+        target = path.join(self.build_base, name + '.gresource')
+        self.mkpath(self.build_base)
+        self.spawn([
+            'glib-compile-resources',
+            '--sourcedir', path.join(here, 'data'),
+            '--target', target,
+            path.join(here, 'data', name + '.gresource.xml')
+            ])
+        self.distribution.data_files.append(('share/' + name, [target]))
+
+
+class build(build_extra):
+    sub_commands = build_extra.sub_commands + [('build_gresource', None)]
+
+
 setup(
         name=name,
         version='0.1',
@@ -35,6 +66,10 @@ setup(
         author_email='andrew.bates@cantab.net',
         license='GPL',
         packages=[PACKAGE_NAME],
+        cmdclass={
+            'build': build,
+            'build_gresource': build_gresource
+        },
         data_files=[ # icons, *ui and *css files are detected automatcially
             ('/etc/lightdm', ['data/configs/lightdm-kbswitch-greeter.conf']),
             ('/usr/share/xgreeters', [